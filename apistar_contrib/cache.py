@@ -0,0 +1,230 @@
+"""
+Response cache with ETags and conditional GETs.
+
+apistar hooks run around the handler and can't short-circuit it, so the
+cache wraps the WSGI app instead:
+
+    app = ResponseCache(App(routes=routes, event_hooks=[...]))
+
+Only successful GET responses are stored. Entries are keyed on the host,
+path and query string, plus the request headers named in the response's
+`Vary`. Responses that set a cookie, vary on `Cookie` (which the session
+and CSRF hooks add when a response depends on them) or carry a private
+`Cache-Control` are never stored.
+"""
+import hashlib
+import re
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+from apistar_contrib import forksafe, metrics
+from apistar_contrib.compat import redis, pickle, PICKLE_VERSION
+
+# Headers kept on a 304, per RFC 7232.
+NOT_MODIFIED_HEADERS = ('cache-control', 'content-location', 'date', 'etag', 'expires', 'vary')
+PRIVATE_DIRECTIVES = ('private', 'no-cache', 'no-store')
+
+_delim_re = re.compile(r'\s*,\s*')
+
+# status, headers, body, etag
+CacheEntry = typing.Tuple[str, typing.List[typing.Tuple[str, str]], bytes, str]
+
+
+class LocalResponseCacheBackend(object):
+    """
+    In-process LRU cache, shared by the threads of one process.
+    """
+
+    def __init__(self, max_entries: int=1000) -> None:
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # type: typing.Dict[str, typing.Tuple[typing.Any, float]]
+        self.lock = threading.Lock()
+        forksafe.register(self)
+
+    def after_fork(self) -> None:
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> typing.Any:
+        with self.lock:
+            try:
+                value, expires = self.entries[key]
+            except KeyError:
+                return None
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: typing.Any, timeout: int) -> None:
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisResponseCacheBackend(object):
+    """
+    Cache shared between processes. Pass `client` to reuse an existing
+    connection pool, e.g. `RedisSessionStore.client`.
+    """
+
+    def __init__(self, redis_url: str=None, client=None, prefix: str='response:') -> None:
+        assert redis is not None, 'redis must be installed'
+        assert redis_url is not None or client is not None, 'redis_url or client is required'
+        self.client = client if client is not None else redis.StrictRedis.from_url(redis_url)
+        # A shared client is reset after a fork by its owner.
+        self.owns_client = client is None
+        self.prefix = prefix
+        forksafe.register(self)
+
+    def after_fork(self) -> None:
+        if self.owns_client:
+            forksafe.reset_redis_client(self.client, prewarm=1)
+
+    def get(self, key: str) -> typing.Any:
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key: str, value: typing.Any, timeout: int) -> None:
+        self.client.set(self.prefix + key, pickle.dumps(value, PICKLE_VERSION), ex=timeout)
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class ResponseCache(object):
+    """
+    WSGI wrapper serving cached responses without reaching the app, and
+    answering a matching `If-None-Match` with 304 Not Modified.
+
+    Entries live for `timeout` seconds, or for the response's `max-age`.
+    """
+
+    def __init__(self, app, backend=None, timeout: int=60) -> None:
+        self.app = app
+        self.backend = backend if backend is not None else LocalResponseCacheBackend()
+        self.timeout = timeout
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'GET' or 'HTTP_AUTHORIZATION' in environ:
+            return self.app(environ, start_response)
+
+        base_key = self.get_base_key(environ)
+        vary = self.backend.get('vary:' + base_key)
+        if vary is not None:
+            entry = self.backend.get(self.get_key(base_key, vary, environ))
+            if entry is not None:
+                if metrics.sink.enabled:
+                    metrics.sink.increment('response_cache', result='hit')
+                return self.respond(environ, start_response, entry)
+        if metrics.sink.enabled:
+            metrics.sink.increment('response_cache', result='miss')
+
+        response = []
+        chunks = []
+
+        def capture(status, headers, exc_info=None):
+            response[:] = [status, headers, exc_info]
+            return chunks.append
+
+        result = self.app(environ, capture)
+        try:
+            chunks.extend(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        status, headers, exc_info = response
+        body = b''.join(chunks)
+
+        timeout = self.get_timeout(status, headers)
+        if timeout is None:
+            start_response(status, headers, exc_info)
+            return [body]
+
+        etag = _get_header(headers, 'etag')
+        if etag is None:
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+            headers = headers + [('etag', etag)]
+        vary = _get_header(headers, 'vary')
+        vary = tuple(_delim_re.split(vary)) if vary else ()
+        entry = (status, headers, body, etag)  # type: CacheEntry
+        self.backend.set('vary:' + base_key, vary, timeout)
+        self.backend.set(self.get_key(base_key, vary, environ), entry, timeout)
+        return self.respond(environ, start_response, entry)
+
+    def respond(self, environ, start_response, entry: CacheEntry):
+        status, headers, body, etag = entry
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None and _etag_matches(if_none_match, etag):
+            if metrics.sink.enabled:
+                metrics.sink.increment('response_cache', result='not_modified')
+            start_response('304 Not Modified',
+                           [(key, value) for key, value in headers if key.lower() in NOT_MODIFIED_HEADERS])
+            return [b'']
+        start_response(status, list(headers))
+        return [body]
+
+    def get_timeout(self, status: str, headers) -> typing.Optional[int]:
+        """
+        Return how long a response may be cached for, or None if it can't be.
+        """
+        if not status.startswith('200 '):
+            return None
+        timeout = self.timeout
+        for key, value in headers:
+            key = key.lower()
+            if key == 'set-cookie':
+                return None
+            elif key == 'vary':
+                vary = {header.lower() for header in _delim_re.split(value)}
+                if '*' in vary or 'cookie' in vary:
+                    return None
+            elif key == 'cache-control':
+                for directive in _delim_re.split(value.lower()):
+                    if directive in PRIVATE_DIRECTIVES:
+                        return None
+                    elif directive.startswith('max-age='):
+                        try:
+                            timeout = int(directive[8:])
+                        except ValueError:
+                            return None
+        return timeout if timeout > 0 else None
+
+    def get_base_key(self, environ) -> str:
+        url = '%s%s%s?%s' % (environ.get('HTTP_HOST', ''), environ.get('SCRIPT_NAME', ''),
+                             environ.get('PATH_INFO', ''), environ.get('QUERY_STRING', ''))
+        return hashlib.sha1(url.encode('latin-1')).hexdigest()
+
+    def get_key(self, base_key: str, vary: typing.Sequence[str], environ) -> str:
+        if not vary:
+            return base_key
+        values = [environ.get('HTTP_' + header.upper().replace('-', '_'), '') for header in vary]
+        return '%s:%s' % (base_key, hashlib.sha1('\n'.join(values).encode('latin-1')).hexdigest())
+
+
+def _get_header(headers, name):
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _etag_matches(if_none_match, etag):
+    if if_none_match.strip() == '*':
+        return True
+    # Weak comparison, as required for If-None-Match.
+    etag = etag[2:] if etag.startswith('W/') else etag
+    for candidate in _delim_re.split(if_none_match.strip()):
+        if (candidate[2:] if candidate.startswith('W/') else candidate) == etag:
+            return True
+    return False
@@ -23,6 +23,20 @@ except ImportError:
     redis = None
 
 
+# pymemcache
+try:
+    from pymemcache.client import hash as pymemcache
+except ImportError:
+    pymemcache = None
+
+
+# zstandard
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
 # pickle
 try:
     import cPickle as pickle
@@ -0,0 +1,198 @@
+import re
+import typing
+from collections import OrderedDict
+from time import time
+
+from apistar import http
+from werkzeug.http import cookie_date, dump_cookie, parse_cookie
+
+NOT_SET = object()
+
+# Values made only of these characters never need quoting, so they can be
+# written straight into a precompiled Set-Cookie header.
+_safe_cookie_value = re.compile(r'[A-Za-z0-9_.\-]*\Z').match
+
+_vary_delim_re = re.compile(r'\s*,\s*')
+
+
+class CookieSpec(object):
+    """
+    Frozen cookie settings with the constant part of the Set-Cookie header
+    precomputed, so each response only has to format the cookie value.
+    """
+    __slots__ = ('name', 'max_age', 'domain', 'path', 'secure', 'httponly',
+                 '_prefix', '_suffix', '_max_age_attr', '_expires')
+
+    def __init__(self, name: str, max_age: int=None, domain: str=None, path: str='/',
+                 secure: bool=False, httponly: bool=False) -> None:
+        self.name = name
+        self.max_age = max_age
+        self.domain = domain
+        self.path = path
+        self.secure = secure
+        self.httponly = httponly
+
+        # Let werkzeug encode the name, domain and path exactly once.
+        header = dump_cookie(name, '', domain=domain, path=path, secure=secure, httponly=httponly)
+        self._prefix, separator, attributes = header.partition(';')
+        self._suffix = separator + attributes
+        self._max_age_attr = self._format_max_age(max_age)
+        self._expires = (None, '')
+
+    def __repr__(self):
+        return '<CookieSpec(name=%r)>' % self.name
+
+    def dump(self, value: str, max_age=NOT_SET) -> str:
+        """
+        Return a Set-Cookie header value. `max_age` overrides the configured
+        age for this one cookie, `None` making it a browser-session cookie.
+        """
+        if not _safe_cookie_value(value):
+            return dump_cookie(
+                self.name, value,
+                max_age=self.max_age if max_age is NOT_SET else max_age,
+                domain=self.domain, path=self.path,
+                secure=self.secure, httponly=self.httponly,
+            )
+
+        if max_age is NOT_SET:
+            max_age = self.max_age
+            max_age_attr = self._max_age_attr
+        else:
+            max_age_attr = self._format_max_age(max_age)
+
+        if max_age is None:
+            return self._prefix + value + self._suffix
+        return self._prefix + value + self._get_expires(max_age) + max_age_attr + self._suffix
+
+    def _format_max_age(self, max_age):
+        if max_age is None:
+            return ''
+        return '; Max-Age=%d' % max_age
+
+    def _get_expires(self, max_age):
+        # Expires only has second resolution, so cache it for the default age.
+        if max_age != self.max_age:
+            return '; Expires=' + cookie_date(time() + max_age)
+        now = int(time())
+        expires_at, expires = self._expires
+        if now != expires_at:
+            expires = '; Expires=' + cookie_date(now + max_age)
+            self._expires = (now, expires)
+        return expires
+
+
+def get_cookie(cookie_header: str, name: str) -> typing.Optional[str]:
+    """
+    Return the value of the named cookie, scanning the Cookie header for
+    that one name instead of parsing every cookie into a mapping. Like
+    werkzeug's `parse_cookie`, the last of several values wins.
+    """
+    if not cookie_header:
+        return None
+    if '"' in cookie_header:
+        # Quoted values may contain `;` and escapes, leave those to werkzeug.
+        return parse_cookie(cookie_header).get(name)
+
+    value = None
+    index = cookie_header.find(name)
+    while index != -1:
+        # Only match at a cookie boundary, so `xsession_id=` is not `session_id=`.
+        boundary = index - 1
+        while boundary >= 0 and cookie_header[boundary] in ' \t':
+            boundary -= 1
+        equals = index + len(name)
+        while equals < len(cookie_header) and cookie_header[equals] in ' \t':
+            equals += 1
+        if (boundary < 0 or cookie_header[boundary] == ';') and cookie_header[equals:equals + 1] == '=':
+            end = cookie_header.find(';', equals)
+            value = (cookie_header[equals + 1:] if end == -1 else cookie_header[equals + 1:end]).strip()
+        index = cookie_header.find(name, index + 1)
+    return value
+
+
+class Cookies(object):
+    """
+    Request-scoped cache of cookie values, shared by the session component
+    and the CSRF hook so each cookie is only looked up once per request.
+    """
+    __slots__ = ('header', '_values')
+
+    def __init__(self, header: str=None) -> None:
+        self.header = header
+        self._values = {}  # type: typing.Dict[str, typing.Optional[str]]
+
+    def get(self, name: str, default: str=None) -> typing.Optional[str]:
+        try:
+            value = self._values[name]
+        except KeyError:
+            value = self._values[name] = get_cookie(self.header, name)
+        return default if value is None else value
+
+
+def get_cookies(headers: http.Headers) -> Cookies:
+    """
+    Return the cookie cache for a request, stored on its `Headers` instance.
+    """
+    try:
+        return headers._cookies
+    except AttributeError:
+        cookies = headers._cookies = Cookies(headers.get('cookie'))
+        return cookies
+
+
+class ResponseCookies(object):
+    """
+    Collects the cookies and `Vary` headers set by the contrib hooks for one
+    response, and writes them as separate Set-Cookie headers in a single pass.
+    """
+    __slots__ = ('cookies', 'vary')
+
+    def __init__(self) -> None:
+        self.cookies = OrderedDict()  # type: typing.Dict[str, str]
+        self.vary = []  # type: typing.List[str]
+
+    def set(self, name: str, header: str) -> None:
+        self.cookies[name] = header
+
+    def add_vary(self, *headers: str) -> None:
+        self.vary.extend(headers)
+
+    def write(self, response: http.Response) -> None:
+        """
+        Replace any previously written contrib cookies and merge the `Vary`
+        header. Cookies set on the response by anything else are kept.
+        """
+        items = []
+        vary = []
+        for key, value in response.headers._list:
+            if key == 'set-cookie' and value.split('=', 1)[0] in self.cookies:
+                continue
+            elif key == 'vary':
+                vary.extend(_vary_delim_re.split(value))
+                continue
+            items.append((key, value))
+
+        # Keep the original order intact, caches may rely on it.
+        existing = {header.lower() for header in vary}
+        for header in self.vary:
+            if header.lower() not in existing:
+                existing.add(header.lower())
+                vary.append(header)
+        if vary:
+            items.append(('vary', ', '.join(vary)))
+
+        items.extend(('set-cookie', header) for header in self.cookies.values())
+        response.headers._list = items
+        response.headers._dict = {key: value for key, value in reversed(items)}
+
+
+def get_response_cookies(response: http.Response) -> ResponseCookies:
+    """
+    Return the cookie collector for a response, stored on the response itself.
+    """
+    try:
+        return response._contrib_cookies
+    except AttributeError:
+        cookies = response._contrib_cookies = ResponseCookies()
+        return cookies
@@ -1 +1,2 @@
-from apistar_contrib.csrf.hook import EnforceCsrfHook, get_token, rotate_token
+from apistar_contrib.csrf.hook import EnforceCsrfHook, SessionCsrfHook, get_token, rotate_token, serve_csrf_token
+from apistar_contrib.csrf.routes import csrf_exempt, csrf_protect, get_exempt_routes
@@ -9,12 +9,15 @@ against request forgeries from other sites.
 """
 from urllib.parse import urlparse
 
-from apistar import App, http, exceptions
+from apistar import App, Route, http, exceptions
 from markupsafe import Markup
-from werkzeug.http import dump_cookie, parse_cookie
 
+from apistar_contrib import metrics
+from apistar_contrib.cookies import Cookies, get_cookies, get_response_cookies
 from apistar_contrib.csrf import utils
-from apistar_contrib.csrf.settings import CsrfSettings
+from apistar_contrib.csrf.routes import get_exempt_routes
+from apistar_contrib.csrf.settings import DEFAULT_SETTINGS, freeze_settings
+from apistar_contrib.sessions.base import Session
 
 REASON_NO_REFERER = "Referer checking failed - no Referer."
 REASON_BAD_REFERER = "Referer checking failed - %s does not match any trusted origins."
@@ -23,6 +26,25 @@ REASON_BAD_TOKEN = "CSRF token missing or incorrect."
 REASON_MALFORMED_REFERER = "Referer checking failed - Referer is malformed."
 REASON_INSECURE_REFERER = "Referer checking failed - Referer is insecure while host is secure."
 
+# Short, bounded labels for reporting rejects to the metrics sink.
+REASON_CODES = {
+    REASON_NO_REFERER: 'no_referer',
+    REASON_NO_CSRF_COOKIE: 'no_csrf_cookie',
+    REASON_BAD_TOKEN: 'bad_token',
+    REASON_MALFORMED_REFERER: 'malformed_referer',
+    REASON_INSECURE_REFERER: 'insecure_referer',
+}
+
+# Rendered in place of the token when CSRF_DEFER_TOKEN is set, to be swapped
+# for a real token by a script or at the edge.
+CSRF_TOKEN_PLACEHOLDER = '__csrf_token__'
+
+
+def _exempt_csrf_token():
+    # Exempt routes load no token, and must not render one left in the
+    # template globals by another request.
+    return Markup('')
+
 
 def get_token(request: http.Request) -> str:
     """
@@ -32,6 +54,21 @@ def get_token(request: http.Request) -> str:
         return request._csrf_hook.get_token()
 
 
+def serve_csrf_token(request: http.Request) -> http.Response:
+    """
+    Handler returning a fresh CSRF token, for pages rendered with
+    CSRF_DEFER_TOKEN. Only this response sets the CSRF cookie, so the
+    pages themselves stay identical for every user and can be cached.
+    """
+    if not hasattr(request, '_csrf_hook'):
+        return http.Response(b'', status_code=404)
+    hook = request._csrf_hook
+    return http.JSONResponse(
+        {'field_name': hook.settings.CSRF_TOKEN_FIELD_NAME, 'csrf_token': hook.get_token()},
+        headers={'Cache-Control': 'no-store'},
+    )
+
+
 def rotate_token(request: http.Request):
     """
     Change the CSRF token in use for a request - should be done on login
@@ -50,7 +87,7 @@ class EnforceCsrfHook:
     template tag.
     """
     def __init__(self, settings=None):
-        self.settings = CsrfSettings(settings or {})
+        self.settings = DEFAULT_SETTINGS if settings is None else freeze_settings(settings)
         self.csrf_token = None
         self.csrf_token_used = False
         self.csrf_cookie_needs_reset = False
@@ -70,23 +107,25 @@ class EnforceCsrfHook:
         self.csrf_cookie_needs_reset = True
 
     def csrf_token_template_hook(self):
+        if self.settings.CSRF_DEFER_TOKEN:
+            # Leave the token unused, so the page sets no cookie and no Vary.
+            token = CSRF_TOKEN_PLACEHOLDER
+        else:
+            token = self.get_token()
         return Markup('<input type="hidden" name="{}" value="{}"/>'
-                      .format(self.settings.CSRF_TOKEN_FIELD_NAME, self.get_token()))
+                      .format(self.settings.CSRF_TOKEN_FIELD_NAME, token))
 
     def _accept(self):
         return None
 
-    def _reject(self, reason):
+    def _reject(self, reason, code=None):
+        if metrics.sink.enabled:
+            metrics.sink.increment('csrf_rejects', reason=code or REASON_CODES.get(reason, 'other'))
         raise exceptions.Forbidden(reason)
 
-    def _load_token(self, cookie_header):
-        if not cookie_header:
-            return
-
-        cookies = parse_cookie(cookie_header)
-        try:
-            cookie_token = cookies[self.settings.CSRF_COOKIE_NAME]
-        except KeyError:
+    def _load_token(self, cookies: Cookies):
+        cookie_token = cookies.get(self.settings.CSRF_COOKIE_NAME)
+        if cookie_token is None:
             return None
 
         csrf_token = utils._sanitize_token(cookie_token)
@@ -97,25 +136,31 @@ class EnforceCsrfHook:
         return csrf_token
 
     def _set_token(self, response):
-        cookie = dump_cookie(
-            self.settings.CSRF_COOKIE_NAME,
-            self.csrf_token,
-            max_age=self.settings.CSRF_COOKIE_AGE,
-            domain=self.settings.CSRF_COOKIE_DOMAIN,
-            path=self.settings.CSRF_COOKIE_PATH,
-            secure=self.settings.CSRF_COOKIE_SECURE,
-            httponly=self.settings.CSRF_COOKIE_HTTPONLY,
-        )
-        response.headers['set-cookie'] = cookie
+        cookies = get_response_cookies(response)
+        cookies.set(self.settings.CSRF_COOKIE_NAME, self.settings.CSRF_COOKIE.dump(self.csrf_token))
         # Set the Vary header since content varies with the CSRF cookie.
-        utils.patch_vary_headers(response, ('Cookie',))
+        cookies.add_vary('Cookie')
+        cookies.write(response)
+
+    def is_exempt(self, app: App, route: Route) -> bool:
+        return get_exempt_routes(app).get(route, self.settings.CSRF_EXEMPT_BY_DEFAULT)
+
+    def on_request(self, app: App, route: Route, request: http.Request, headers: http.Headers,
+                   data: http.RequestData, server_scheme: http.Scheme, server_host: http.Host,
+                   server_port: http.Port):
+        if self.is_exempt(app, route):
+            # Nothing is loaded or used, so on_response has nothing to set either.
+            utils.update_global_template_context(app, csrf_token=_exempt_csrf_token)
+            return None
+        with metrics.timed('csrf_request'):
+            return self._process_request(app, request, get_cookies(headers), data,
+                                         server_scheme, server_host, server_port)
 
-    def on_request(self, app: App, request: http.Request, cookie: http.Header, data: http.RequestData,
-                   server_scheme: http.Scheme, server_host: http.Host, server_port: http.Port):
+    def _process_request(self, app, request, token_store, data, server_scheme, server_host, server_port):
         request._csrf_hook = self
         utils.update_global_template_context(app, csrf_token=self.csrf_token_template_hook)
 
-        csrf_token = self._load_token(cookie)
+        csrf_token = self._load_token(token_store)
         if csrf_token is not None:
             # Use same token next time.
             self.csrf_token = csrf_token
@@ -175,12 +220,11 @@ class EnforceCsrfHook:
                 # Here we generate a list of all acceptable HTTP referers,
                 # including the current host since that has been validated
                 # upstream.
-                good_hosts = list(self.settings.CSRF_TRUSTED_ORIGINS)
-                good_hosts.append(good_referer)
+                good_hosts = self.settings.CSRF_TRUSTED_ORIGINS + (good_referer,)
 
                 if not any(utils.is_same_domain(referer.netloc, host) for host in good_hosts):
                     reason = REASON_BAD_REFERER % referer.geturl()
-                    return self._reject(reason)
+                    return self._reject(reason, code='bad_referer')
 
             if self.csrf_token is None:
                 # No CSRF cookie. For POST requests, we insist on a CSRF cookie,
@@ -208,7 +252,49 @@ class EnforceCsrfHook:
         if exc is not None:
             raise exc
 
-        if self.csrf_token_used or self.csrf_cookie_needs_reset:
+        if self.csrf_token_used or (self.csrf_cookie_needs_reset and not self.settings.CSRF_DEFER_TOKEN):
             # Set the CSRF cookie even if it's already set, so we renew
-            # the expiry timer.
+            # the expiry timer. Deferred pages leave a bad cookie for the
+            # token endpoint to replace.
             self._set_token(response)
+
+
+class SessionCsrfHook(EnforceCsrfHook):
+    """
+    Keep the CSRF secret in the session instead of a separate CSRF cookie,
+    so requests don't parse it and responses don't re-set it.
+
+    Requires `SessionComponent`, and must be listed after `SessionHook` so
+    the token is stored before the session is saved.
+    """
+    session = None
+
+    def on_request(self, app: App, route: Route, request: http.Request, session: Session,
+                   data: http.RequestData, server_scheme: http.Scheme, server_host: http.Host,
+                   server_port: http.Port):
+        if self.is_exempt(app, route):
+            utils.update_global_template_context(app, csrf_token=_exempt_csrf_token)
+            return None
+        self.session = session
+        with metrics.timed('csrf_request'):
+            return self._process_request(app, request, session, data,
+                                         server_scheme, server_host, server_port)
+
+    def _load_token(self, session: Session):
+        session_token = session.get(self.settings.CSRF_SESSION_KEY)
+        if session_token is None:
+            return None
+
+        csrf_token = utils._sanitize_token(session_token)
+        if csrf_token != session_token:
+            self.csrf_cookie_needs_reset = True
+        return csrf_token
+
+    def _set_token(self, response):
+        # Only write the session when the token actually changed.
+        if self.session.get(self.settings.CSRF_SESSION_KEY) != self.csrf_token:
+            self.session[self.settings.CSRF_SESSION_KEY] = self.csrf_token
+        # Content still varies with the session cookie.
+        cookies = get_response_cookies(response)
+        cookies.add_vary('Cookie')
+        cookies.write(response)
@@ -0,0 +1,46 @@
+import typing
+
+from apistar import App, Route
+
+
+def csrf_exempt(view):
+    """
+    Mark a handler or `Route` as not needing CSRF protection, e.g. API
+    routes authenticated by a token rather than a cookie.
+    """
+    view.csrf_exempt = True
+    return view
+
+
+def csrf_protect(view):
+    """
+    Mark a handler or `Route` as needing CSRF protection, even when
+    `CSRF_EXEMPT_BY_DEFAULT` is set.
+    """
+    view.csrf_exempt = False
+    return view
+
+
+def get_exempt_routes(app: App) -> typing.Dict[Route, bool]:
+    """
+    Return the marked routes of `app`, mapped to whether they are exempt.
+
+    The router is built once at startup, so the table is resolved on first
+    use and kept on it. Markers on a `Route` take precedence over markers on
+    its handler.
+    """
+    router = app.router
+    try:
+        return router._csrf_exempt_routes
+    except AttributeError:
+        pass
+
+    table = {}
+    for route in getattr(router, 'name_lookups', {}).values():
+        exempt = getattr(route, 'csrf_exempt', None)
+        if exempt is None:
+            exempt = getattr(route.handler, 'csrf_exempt', None)
+        if exempt is not None:
+            table[route] = exempt
+    router._csrf_exempt_routes = table
+    return table
@@ -1,5 +1,10 @@
+import typing
+from collections import namedtuple
+
 from apistar import types, validators
 
+from apistar_contrib.cookies import CookieSpec
+
 
 # Settings for CSRF cookie.
 class CsrfSettings(types.Type):
@@ -12,3 +17,33 @@ class CsrfSettings(types.Type):
     CSRF_HEADER_NAME = validators.String(default='HTTP_X_CSRFTOKEN')
     CSRF_TOKEN_FIELD_NAME = validators.String(default='csrf_token')
     CSRF_TRUSTED_ORIGINS = validators.Array(default=[])
+    CSRF_SESSION_KEY = validators.String(default='_csrftoken')
+    CSRF_EXEMPT_BY_DEFAULT = validators.Boolean(default=False)
+    CSRF_DEFER_TOKEN = validators.Boolean(default=False)
+
+
+# Validated settings snapshot used on the request path, plus the precompiled cookie.
+FrozenCsrfSettings = namedtuple(
+    'FrozenCsrfSettings', list(CsrfSettings.validator.properties) + ['CSRF_COOKIE'])
+
+
+def freeze_settings(settings: typing.Union[CsrfSettings, typing.Mapping]=None) -> FrozenCsrfSettings:
+    if isinstance(settings, FrozenCsrfSettings):
+        return settings
+    if not isinstance(settings, CsrfSettings):
+        settings = CsrfSettings(settings or {})
+    values = dict(settings._dict)
+    values['CSRF_TRUSTED_ORIGINS'] = tuple(values['CSRF_TRUSTED_ORIGINS'])
+    cookie = CookieSpec(
+        settings.CSRF_COOKIE_NAME,
+        max_age=settings.CSRF_COOKIE_AGE,
+        domain=settings.CSRF_COOKIE_DOMAIN,
+        path=settings.CSRF_COOKIE_PATH,
+        secure=settings.CSRF_COOKIE_SECURE,
+        httponly=settings.CSRF_COOKIE_HTTPONLY,
+    )
+    return FrozenCsrfSettings(CSRF_COOKIE=cookie, **values)
+
+
+# Default settings are validated once at import rather than on every request.
+DEFAULT_SETTINGS = freeze_settings()
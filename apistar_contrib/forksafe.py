@@ -0,0 +1,67 @@
+"""
+Fork awareness for servers that create the app before forking workers,
+such as gunicorn with `--preload`.
+
+Objects holding connections, threads or locks register themselves and
+have their `after_fork` method called in every forked child, through
+`os.register_at_fork`. On Python versions without it, call
+`after_fork_in_child` from the server's post-fork hook instead.
+"""
+import logging
+import os
+import threading
+import weakref
+
+from apistar_contrib import compat
+
+logger = logging.getLogger(__name__)
+
+_registry = weakref.WeakSet()
+
+
+def register(obj) -> None:
+    _registry.add(obj)
+
+
+def after_fork_in_child() -> None:
+    if not compat.using_sysrandom:
+        # The fallback generator would hand out the parent's sequence.
+        compat.random.seed()
+    for obj in list(_registry):
+        try:
+            obj.after_fork()
+        except Exception:
+            logger.exception('Failed to reset %r after fork', obj)
+
+
+def reset_redis_client(client, prewarm: int=0) -> None:
+    """
+    Drop the connections inherited from the parent, without closing the
+    parent's sockets, and open `prewarm` new ones in the background, so an
+    unreachable Redis doesn't hold up the worker's start.
+    """
+    pool = client.connection_pool
+    pool.reset()
+    if prewarm:
+        thread = threading.Thread(target=_prewarm, args=(pool, prewarm), name='redis-prewarm', daemon=True)
+        thread.start()
+
+
+def _prewarm(pool, count):
+    connections = []
+    try:
+        for _ in range(count):
+            try:
+                connections.append(pool.get_connection())
+            except TypeError:
+                # redis-py before 5.3 requires a command name.
+                connections.append(pool.get_connection('PING'))
+    except Exception:
+        logger.warning('Failed to pre-warm Redis connections after fork', exc_info=True)
+    finally:
+        for connection in connections:
+            pool.release(connection)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork_in_child)
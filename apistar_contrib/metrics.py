@@ -0,0 +1,154 @@
+"""
+Instrumentation for the session and CSRF hot paths.
+
+Metrics are reported to a single process-wide sink. The default sink is a
+no-op with `enabled = False`, which the instrumented code checks before
+doing any timing work. Install `PrometheusMetrics` (or any `MetricsSink`)
+with `set_sink` to start collecting.
+"""
+import threading
+from time import perf_counter
+
+from apistar import http
+
+from apistar_contrib import forksafe
+
+
+class MetricsSink(object):
+    """
+    No-op metrics sink, subclass it to forward metrics somewhere else.
+    """
+    enabled = False
+
+    def increment(self, name: str, value: int=1, **labels: str) -> None:
+        pass
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        pass
+
+
+class PrometheusMetrics(MetricsSink):
+    """
+    In-process counters and timings, rendered in the Prometheus text format.
+    Timings are exported as summaries (`_sum` and `_count`).
+    """
+    enabled = True
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, namespace: str='apistar_contrib') -> None:
+        self.namespace = namespace
+        self.counters = {}
+        self.timings = {}
+        self.lock = threading.Lock()
+        forksafe.register(self)
+
+    def after_fork(self) -> None:
+        self.lock = threading.Lock()
+
+    def increment(self, name: str, value: int=1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            timing = self.timings.setdefault(key, [0.0, 0])
+            timing[0] += seconds
+            timing[1] += 1
+
+    def get(self, name: str, **labels: str) -> float:
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def render(self) -> str:
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timings = sorted((key, list(value)) for key, value in self.timings.items())
+
+        lines = []
+        declared = set()
+        for (name, labels), value in counters:
+            metric = '%s_%s_total' % (self.namespace, name)
+            if metric not in declared:
+                declared.add(metric)
+                lines.append('# TYPE %s counter' % metric)
+            lines.append('%s%s %s' % (metric, self._format_labels(labels), _format_value(value)))
+        for (name, labels), (total, count) in timings:
+            metric = '%s_%s_seconds' % (self.namespace, name)
+            if metric not in declared:
+                declared.add(metric)
+                lines.append('# TYPE %s summary' % metric)
+            lines.append('%s_sum%s %r' % (metric, self._format_labels(labels), total))
+            lines.append('%s_count%s %d' % (metric, self._format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def _format_labels(self, labels):
+        if not labels:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (key, _escape_label(value)) for key, value in labels)
+
+
+def _format_value(value):
+    return '%d' % value if value == int(value) else repr(float(value))
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class _Timer(object):
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        sink.observe(self.name, perf_counter() - self.start, **self.labels)
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_null_timer = _NullTimer()
+
+sink = MetricsSink()
+
+
+def set_sink(metrics_sink: MetricsSink) -> None:
+    global sink
+    sink = metrics_sink
+
+
+def get_sink() -> MetricsSink:
+    return sink
+
+
+def timed(name: str, **labels: str):
+    """
+    Context manager timing a block into the active sink, or a shared no-op
+    when metrics are disabled.
+    """
+    if not sink.enabled:
+        return _null_timer
+    return _Timer(name, labels)
+
+
+def serve_metrics() -> http.Response:
+    """
+    Handler exposing the active sink in the Prometheus text format.
+    """
+    if not hasattr(sink, 'render'):
+        return http.Response(b'', status_code=404)
+    return http.Response(sink.render(), headers={'content-type': PrometheusMetrics.content_type})
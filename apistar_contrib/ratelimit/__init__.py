@@ -0,0 +1,5 @@
+from apistar_contrib.ratelimit.base import (
+    RateLimit, RateLimiter, RateLimitComponent, RateLimitHook, TooManyRequests,
+)
+from apistar_contrib.ratelimit.local import LocalRateLimiter
+from apistar_contrib.ratelimit.redis import RedisRateLimiter
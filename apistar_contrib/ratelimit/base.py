@@ -0,0 +1,155 @@
+import abc
+import threading
+import time
+import typing
+from collections import OrderedDict, namedtuple
+
+from apistar import exceptions, http, Component
+from apistar.server.wsgi import WSGIEnviron
+
+from apistar_contrib import forksafe, metrics
+from apistar_contrib.sessions.base import Session
+
+# Outcome of one rate limited request. `remaining` counts whole tokens left,
+# `retry_after` is the number of seconds until the request would be allowed.
+RateLimit = namedtuple('RateLimit', ['key', 'allowed', 'limit', 'remaining', 'retry_after'])
+
+
+class TooManyRequests(exceptions.HTTPException):
+    default_status_code = 429
+    default_detail = 'Too many requests'
+
+    def __init__(self, retry_after: float, detail: str=None) -> None:
+        self.retry_after = retry_after
+        super().__init__(detail)
+
+    def get_headers(self):
+        return {'Retry-After': str(max(1, int(self.retry_after + 0.999)))}
+
+
+class RateLimiter(abc.ABC):
+    """
+    Token bucket holding up to `burst` tokens (default `rate`), refilled
+    with `rate` tokens every `period` seconds. Each request takes `cost`
+    tokens and is refused if the bucket does not hold enough.
+
+    With `lease_size` set, a request that has to reach the backend takes up
+    to that many extra tokens, which later requests in this process then use
+    without a round-trip. Leased tokens are dropped after `lease_ttl`
+    seconds, so a process never hands out more than the backend granted and
+    the limit can only err on the strict side.
+    """
+    backend = 'custom'
+    clock = staticmethod(time.time)
+
+    def __init__(self, rate: int, period: float=1.0, burst: int=None,
+                 lease_size: int=0, lease_ttl: float=1.0, max_leases: int=10000) -> None:
+        self.rate = rate
+        self.period = period
+        self.capacity = burst if burst is not None else rate
+        self.refill_rate = rate / period
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        self.max_leases = max_leases
+        self.leases = OrderedDict()  # type: typing.Dict[str, list]
+        self.lease_lock = threading.Lock()
+        forksafe.register(self)
+
+    def after_fork(self) -> None:
+        # Tokens leased by the parent must not be spent twice.
+        self.leases = OrderedDict()
+        self.lease_lock = threading.Lock()
+
+    def hit(self, key: str, cost: int=1) -> RateLimit:
+        now = self.clock()
+        if self.lease_size:
+            with self.lease_lock:
+                lease = self.leases.get(key)
+                if lease is not None and lease[0] >= cost and lease[1] > now:
+                    lease[0] -= cost
+                    if metrics.sink.enabled:
+                        metrics.sink.increment('rate_limits', store=self.backend, result='leased')
+                    return RateLimit(key, True, self.capacity, int(lease[2]) + lease[0], 0.0)
+
+        granted, tokens = self.take(key, cost, cost + self.lease_size, now)
+        allowed = granted >= cost
+        if allowed and granted > cost:
+            with self.lease_lock:
+                # Leased tokens, expiry, and what the backend had left.
+                self.leases[key] = [granted - cost, now + self.lease_ttl, tokens]
+                self.leases.move_to_end(key)
+                while len(self.leases) > self.max_leases:
+                    self.leases.popitem(last=False)
+
+        if metrics.sink.enabled:
+            metrics.sink.increment('rate_limits', store=self.backend, result='allowed' if allowed else 'limited')
+        if allowed:
+            return RateLimit(key, True, self.capacity, int(tokens) + granted - cost, 0.0)
+        return RateLimit(key, False, self.capacity, int(tokens), (cost - tokens) / self.refill_rate)
+
+    @abc.abstractmethod
+    def take(self, key: str, minimum: int, maximum: int, now: float) -> typing.Tuple[int, float]:
+        """
+        Refill the bucket for `key` up to `now` and, if it holds at least
+        `minimum` tokens, take as many as possible up to `maximum`. Returns
+        the number of tokens taken and the number left in the bucket.
+        """
+        raise NotImplementedError
+
+
+def refill(tokens: float, updated: float, now: float, capacity: int, refill_rate: float) -> float:
+    return min(capacity, tokens + max(0.0, now - updated) * refill_rate)
+
+
+class RateLimitComponent(Component):
+    """
+    Resolves the `RateLimit` of each request, taking a token from the
+    limiter. `key` is `'ip'`, `'session'` or a callable returning a key for a
+    WSGI environ. `'session'` needs `SessionComponent`, only sessions found in
+    the store get their own bucket and everything else shares the client IP's.
+    """
+
+    def __init__(self, limiter: type, *args, key: typing.Union[str, typing.Callable]='ip', **kwargs):
+        assert issubclass(limiter, RateLimiter)
+        assert callable(key) or key in ('ip', 'session')
+        self.limiter = limiter(*args, **kwargs)
+        self.key = key
+        if key == 'session':
+            # The injector reads the signature of `resolve`, only ask for the
+            # session when it is used.
+            self.resolve = self.resolve_session
+
+    def get_key(self, environ: WSGIEnviron, session: Session=None) -> str:
+        if callable(self.key):
+            return self.key(environ)
+        if session is not None and not session.is_new:
+            return 'session:' + session.session_id
+        # New sessions include forged IDs, which must not get a fresh bucket.
+        return 'ip:' + environ.get('REMOTE_ADDR', '')
+
+    def resolve(self, environ: WSGIEnviron) -> RateLimit:
+        with metrics.timed('rate_limit', store=self.limiter.backend):
+            return self.limiter.hit(self.get_key(environ))
+
+    def resolve_session(self, environ: WSGIEnviron, session: Session) -> RateLimit:
+        with metrics.timed('rate_limit', store=self.limiter.backend):
+            return self.limiter.hit(self.get_key(environ, session))
+
+
+class RateLimitHook:
+    """
+    Rejects requests over the limit with 429 Too Many Requests, and reports
+    the limit on every response.
+    """
+    rate_limit = None
+
+    def on_request(self, rate_limit: RateLimit):
+        # Kept on the hook, resolving the component again would take another token.
+        self.rate_limit = rate_limit
+        if not rate_limit.allowed:
+            raise TooManyRequests(rate_limit.retry_after)
+
+    def on_response(self, response: http.Response):
+        if self.rate_limit is not None:
+            response.headers['X-RateLimit-Limit'] = str(self.rate_limit.limit)
+            response.headers['X-RateLimit-Remaining'] = str(self.rate_limit.remaining)
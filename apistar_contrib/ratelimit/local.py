@@ -0,0 +1,31 @@
+import threading
+import typing
+
+from apistar_contrib.ratelimit.base import RateLimiter, refill
+
+
+class LocalRateLimiter(RateLimiter):
+    """
+    Buckets kept in process memory, for development and tests.
+    """
+    backend = 'local'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = {}  # type: typing.Dict[str, typing.Tuple[float, float]]
+        self.lock = threading.Lock()
+
+    def after_fork(self) -> None:
+        super().after_fork()
+        self.lock = threading.Lock()
+
+    def take(self, key: str, minimum: int, maximum: int, now: float) -> typing.Tuple[int, float]:
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.capacity, now))
+            tokens = refill(tokens, updated, now, self.capacity, self.refill_rate)
+            granted = 0
+            if tokens >= minimum:
+                granted = min(maximum, int(tokens))
+                tokens -= granted
+            self.buckets[key] = (tokens, now)
+            return granted, tokens
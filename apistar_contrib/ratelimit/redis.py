@@ -0,0 +1,70 @@
+import typing
+
+from apistar_contrib import forksafe
+from apistar_contrib.compat import redis
+from apistar_contrib.ratelimit.base import RateLimiter
+
+# Refill and take from a token bucket stored as a hash of `tokens` and `ts`.
+# ARGV is capacity, refill rate per second, now, minimum and maximum to take.
+# An empty `now` uses the Redis server's clock, which all processes share.
+# Returns the number of tokens taken and, as a string, the number left.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+if not now then
+    -- Redis before 5 only allows writes after TIME with effects replication.
+    if redis.replicate_commands then redis.replicate_commands() end
+    local time = redis.call('TIME')
+    now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+end
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local granted = 0
+if tokens >= tonumber(ARGV[4]) then
+    granted = math.min(tonumber(ARGV[5]), math.floor(tokens))
+    tokens = tokens - granted
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', string.format('%.6f', now))
+-- A bucket that would be full again holds no state worth keeping.
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {granted, tostring(tokens)}
+"""
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Buckets shared between processes, updated by a single Lua call per
+    request. Pass `client` to share a connection pool, e.g. the one of a
+    `RedisSessionStore`.
+    """
+    backend = 'redis'
+
+    def __init__(self, redis_url: str=None, *args, client=None, **kwargs) -> None:
+        assert redis is not None, 'redis must be installed'
+        assert redis_url is not None or client is not None, 'redis_url or client is required'
+        self.client = client if client is not None else redis.StrictRedis.from_url(redis_url)
+        # A shared client is reset after a fork by its owner.
+        self.owns_client = client is None
+        self.bucket_script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+        super().__init__(*args, **kwargs)
+
+    def after_fork(self) -> None:
+        super().after_fork()
+        if self.owns_client:
+            forksafe.reset_redis_client(self.client, prewarm=1)
+
+    def get_key(self, key: str) -> str:
+        return 'rate_limit:{}'.format(key)
+
+    def take(self, key: str, minimum: int, maximum: int, now: float) -> typing.Tuple[int, float]:
+        # Hosts' clocks drift apart, so buckets follow the Redis server's
+        # unless a `clock` was set on the limiter, e.g. in tests.
+        timestamp = '' if self.clock is RateLimiter.clock else repr(now)
+        granted, tokens = self.bucket_script(
+            keys=[self.get_key(key)],
+            args=[self.capacity, self.refill_rate, timestamp, minimum, maximum],
+        )
+        return int(granted), float(tokens)
@@ -1,3 +1,4 @@
 from apistar_contrib.sessions.base import Session, SessionStore, SessionComponent, SessionHook
 from apistar_contrib.sessions.local import LocalMemorySessionStore
 from apistar_contrib.sessions.redis import RedisSessionStore
+from apistar_contrib.sessions.memcached import MemcachedSessionStore
@@ -1,17 +1,35 @@
 import abc
+import itertools
 import random
 import typing
+from collections.abc import MutableMapping
 
 from apistar import http, Component
-from werkzeug.http import parse_cookie, dump_cookie
 
-from apistar_contrib.sessions.settings import SessionSettings, SettingsMapping
+from apistar_contrib import metrics
+from apistar_contrib.cookies import NOT_SET, get_cookies, get_response_cookies
+from apistar_contrib.sessions.settings import SessionSettings, SettingsMapping, freeze_settings
 
-NOT_SET = object()
 
+class SessionConflict(Exception):
+    """
+    Raised when a versioned session could not be saved after merging.
+    """
 
-class Session(object):
-    def __init__(self, store, session_id: str, data: typing.Dict[str, typing.Any]=None) -> None:
+
+class Session(MutableMapping):
+    """
+    Session data with change tracking. Every method that changes `data`
+    marks the session modified and records the key in `changed_keys`;
+    values mutated in place are not seen.
+    """
+    __slots__ = (
+        'store', 'settings', 'data', 'is_new', 'needs_cookie', 'is_modified', 'is_cleared',
+        'is_rotated', 'session_id', 'expires', 'version', 'changed_keys', 'owner', 'digests',
+    )
+
+    def __init__(self, store, session_id: str, data: typing.Dict[str, typing.Any]=None,
+                 version: int=None) -> None:
         self.store = store
         self.settings = store.session_settings
 
@@ -26,8 +44,15 @@ class Session(object):
 
         self.is_modified = False
         self.is_cleared = False
+        self.is_rotated = False
         self.session_id = session_id
         self.expires = NOT_SET
+        self.version = version
+        self.changed_keys = set()  # type: typing.Set[str]
+        # Owner the session was loaded with, for stores that index by owner.
+        self.owner = None
+        # Digests of the stored data, for stores that detect changes.
+        self.digests = None
 
     def __contains__(self, key: str) -> bool:
         return key in self.data
@@ -38,21 +63,96 @@ class Session(object):
     def __setitem__(self, key: str, value: typing.Any) -> None:
         self.data[key] = value
         self.is_modified = True
+        self.changed_keys.add(key)
 
     def __delitem__(self, key: str):
         del self.data[key]
         self.is_modified = True
+        self.changed_keys.add(key)
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    # A session is an object with an identity, not a value: it stays truthy
+    # when empty, and compares and hashes by identity as it did before it
+    # was a mapping.
+    def __bool__(self) -> bool:
+        return True
+
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+    __hash__ = object.__hash__
+
+    def get(self, key: str, default: typing.Any=None) -> typing.Any:
+        return self.data.get(key, default)
+
+    def keys(self) -> typing.KeysView[str]:
+        return self.data.keys()
+
+    def items(self) -> typing.ItemsView[str, typing.Any]:
+        return self.data.items()
 
-    def __getattr__(self, item):
-        if item in ('get', 'pop', 'update'):
-            return getattr(self.data, item)
-        raise AttributeError
+    def values(self) -> typing.ValuesView[typing.Any]:
+        return self.data.values()
+
+    def pop(self, key: str, default: typing.Any=NOT_SET) -> typing.Any:
+        if key in self.data:
+            self.is_modified = True
+            self.changed_keys.add(key)
+            return self.data.pop(key)
+        if default is NOT_SET:
+            raise KeyError(key)
+        return default
+
+    def setdefault(self, key: str, default: typing.Any=None) -> typing.Any:
+        if key in self.data:
+            return self.data[key]
+        self[key] = default
+        return default
+
+    def update(self, *args, **kwargs) -> None:
+        values = dict(*args, **kwargs)
+        if values:
+            self.data.update(values)
+            self.is_modified = True
+            self.changed_keys.update(values)
 
     def clear(self):
         self.data = {}
         self.is_cleared = True
         self.needs_cookie = True
         self.expires = NOT_SET
+        self.version = None
+        self.changed_keys = set()
+
+    def merge(self, data: typing.Dict[str, typing.Any], version: int=None):
+        """
+        Rebase this session's changes onto data written by a concurrent
+        request. Keys set or deleted here win, everything else is kept.
+        When `is_modified` was set by hand there is no record of what
+        changed, so every key held here wins.
+        """
+        changed_keys = self.changed_keys
+        if self.is_modified and not changed_keys:
+            changed_keys = self.data.keys()
+        for key in changed_keys:
+            if key in self.data:
+                data[key] = self.data[key]
+            else:
+                data.pop(key, None)
+        self.data = data
+        self.version = version
+
+    def rotate_id(self):
+        """
+        Move the session to a new ID on save, keeping its data. Do this on
+        login to prevent session fixation.
+        """
+        self.is_rotated = True
+        self.needs_cookie = True
 
     def save(self):
         return self.store.save(self)
@@ -63,8 +163,11 @@ class Session(object):
 
 
 class SessionStore(abc.ABC):
+    # Label used to break metrics down by store backend.
+    backend = 'custom'
+
     def __init__(self, session_settings: SessionSettings, **kwargs):
-        self.session_settings = session_settings
+        self.session_settings = freeze_settings(session_settings)
 
     def new(self) -> Session:
         session_id = self._generate_key()
@@ -75,9 +178,74 @@ class SessionStore(abc.ABC):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def save(self, session: Session) -> None:
+    def save(self, session: Session) -> bool:
+        """
+        Persist the session if needed, returning whether anything was written.
+        """
         raise NotImplementedError
 
+    # Administration. Stores provide `iter_session_ids`, `delete_many` and
+    # `idle_times`, everything else works on top of those in batches.
+
+    def iter_session_ids(self, batch_size: int=1000) -> typing.Iterator[str]:
+        raise NotImplementedError
+
+    def load_many(self, session_ids: typing.Sequence[str]) -> typing.List[typing.Optional[Session]]:
+        """
+        Load several sessions at once, with None for the ones that don't exist.
+        """
+        sessions = [self.load(session_id) for session_id in session_ids]
+        return [None if session.is_new else session for session in sessions]
+
+    def delete_many(self, session_ids: typing.Sequence[str]) -> None:
+        raise NotImplementedError
+
+    def idle_times(self, session_ids: typing.Sequence[str]) -> typing.List[typing.Optional[float]]:
+        """
+        Seconds since each session was last used, None if unknown.
+        """
+        raise NotImplementedError
+
+    def iter_sessions(self, batch_size: int=1000) -> typing.Iterator[Session]:
+        """
+        Lazily iterate over all stored sessions, loading `batch_size` at a time.
+        """
+        for batch in _chunks(self.iter_session_ids(batch_size), batch_size):
+            for session in self.load_many(batch):
+                if session is not None:
+                    yield session
+
+    def count(self, batch_size: int=1000) -> int:
+        """
+        Count the stored sessions. Stores that walk a changing keyspace may
+        see a session twice, so treat the result as approximate.
+        """
+        return sum(1 for session_id in self.iter_session_ids(batch_size))
+
+    def purge(self, predicate: typing.Callable[[Session], bool]=None, idle_for: float=None,
+              batch_size: int=1000) -> int:
+        """
+        Delete sessions idle for at least `idle_for` seconds and/or matching
+        `predicate`, `batch_size` at a time. Returns the number deleted.
+        """
+        assert predicate is not None or idle_for is not None, 'predicate or idle_for is required'
+        purged = 0
+        for batch in _chunks(self.iter_session_ids(batch_size), batch_size):
+            if idle_for is not None:
+                batch = [
+                    session_id for session_id, idle_time in zip(batch, self.idle_times(batch))
+                    if idle_time is not None and idle_time >= idle_for
+                ]
+            if predicate is not None and batch:
+                batch = [
+                    session.session_id for session in self.load_many(batch)
+                    if session is not None and predicate(session)
+                ]
+            if batch:
+                self.delete_many(batch)
+                purged += len(batch)
+        return purged
+
     def _generate_key(self) -> str:
         length = 30
         allowed_chars = 'abcdefghijklmnopqrstuvwxyz0123456789'
@@ -85,39 +253,52 @@ class SessionStore(abc.ABC):
         return ''.join(urandom.choice(allowed_chars) for i in range(length))
 
 
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 class SessionComponent(Component):
     def __init__(self, store: type, *args, session_settings: SettingsMapping=None, **kwargs):
         assert issubclass(store, SessionStore)
-        self.settings = SessionSettings(session_settings or {})
+        self.settings = freeze_settings(session_settings)
         kwargs['session_settings'] = self.settings
         self.store = store(*args, **kwargs)
 
-    def resolve(self, cookie: http.Header) -> Session:
-        if cookie:
-            cookies = parse_cookie(cookie)
-            session_id = cookies.get(self.settings.cookie_name)
-        else:
-            session_id = None
-
-        if session_id is not None:
-            session = self.store.load(session_id)
-        else:
-            session = self.store.new()
+    def resolve(self, headers: http.Headers) -> Session:
+        backend = self.store.backend
+        with metrics.timed('session_resolve', store=backend):
+            session_id = get_cookies(headers).get(self.settings.cookie_name)
+            if session_id is not None:
+                with metrics.timed('session_load', store=backend):
+                    session = self.store.load(session_id)
+                if metrics.sink.enabled:
+                    metrics.sink.increment('session_loads', store=backend, result='miss' if session.is_new else 'hit')
+            else:
+                session = self.store.new()
 
         return session
 
 
 class SessionHook:
     def on_response(self, session: Session, response: http.Response):
-        session.save()
-        if session.needs_cookie:
-            cookie = dump_cookie(
-                session.settings.cookie_name,
-                session.session_id,
-                max_age=session.settings.cookie_age if session.expires is NOT_SET else session.expires,
-                domain=session.settings.cookie_domain,
-                path=session.settings.cookie_path,
-                secure=session.settings.cookie_secure,
-                httponly=session.settings.cookie_httponly,
-            )
-            response.headers['set-cookie'] = cookie
+        backend = session.store.backend
+        with metrics.timed('session_hook', store=backend):
+            with metrics.timed('session_save', store=backend):
+                written = session.save()
+            if metrics.sink.enabled:
+                metrics.sink.increment('session_writes', store=backend,
+                                       result='skipped' if written is False else 'written')
+
+            if session.needs_cookie or not session.is_new:
+                cookies = get_response_cookies(response)
+                if session.needs_cookie:
+                    cookie = session.settings.cookie.dump(session.session_id, max_age=session.expires)
+                    cookies.set(session.settings.cookie_name, cookie)
+                # The response may depend on the session, keep shared caches from storing it.
+                cookies.add_vary('Cookie')
+                cookies.write(response)
@@ -0,0 +1,83 @@
+import threading
+import typing
+from time import monotonic
+
+from apistar_contrib import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling a backend that is known to be failing.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a backend after `failure_threshold` consecutive failures,
+    counting calls slower than `slow_call_threshold` seconds as failures.
+    After `reset_timeout` seconds a single trial call is let through, and
+    the circuit closes again if it succeeds.
+    """
+
+    def __init__(self, name: str, errors: typing.Tuple[type, ...], failure_threshold: int=5,
+                 slow_call_threshold: float=None, reset_timeout: float=10.0) -> None:
+        self.name = name
+        self.errors = errors
+        self.failure_threshold = failure_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def after_fork(self) -> None:
+        self.lock = threading.Lock()
+
+    def call(self, func: typing.Callable, *args, **kwargs) -> typing.Any:
+        self._before_call()
+        start = monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except self.errors:
+            self._record(False)
+            raise
+        except BaseException:
+            # Errors that don't implicate the backend, still free a trial call.
+            self._record(True)
+            raise
+        slow = self.slow_call_threshold is not None and monotonic() - start > self.slow_call_threshold
+        self._record(not slow)
+        return result
+
+    def _before_call(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+                return
+        raise CircuitOpen('Circuit %r is open' % self.name)
+
+    def _record(self, success):
+        with self.lock:
+            if success:
+                self.failures = 0
+                if self.state != CLOSED:
+                    self._set_state(CLOSED)
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = monotonic()
+                if self.state != OPEN:
+                    self._set_state(OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        if metrics.sink.enabled:
+            metrics.sink.increment('circuit_transitions', circuit=self.name, state=state)
@@ -0,0 +1,83 @@
+import threading
+import typing
+from collections import OrderedDict
+
+from apistar_contrib import metrics
+
+
+class _Batch(object):
+    __slots__ = ('keys', 'has_leader', 'done', 'results', 'error')
+
+    def __init__(self):
+        self.keys = OrderedDict()  # type: typing.Dict[str, None]
+        self.has_leader = False
+        self.done = threading.Event()
+        self.results = None  # type: typing.Dict[str, typing.Any]
+        self.error = None  # type: Exception
+
+
+class LoadCoalescer(object):
+    """
+    Batches concurrent loads into one `fetch_many` call.
+
+    The first thread to ask for a key leads a batch. While another batch is
+    being fetched, or for up to `window` seconds, other threads add their keys
+    to it and wait. The leader then fetches every key once and hands each
+    thread its result. Without concurrency a load goes out immediately.
+    """
+
+    def __init__(self, fetch_many: typing.Callable[[typing.List[str]], typing.List[typing.Any]],
+                 window: float=0.0, max_batch: int=100) -> None:
+        self.fetch_many = fetch_many
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = None  # type: _Batch
+        self.in_flight = False
+        self.condition = threading.Condition()
+
+    def after_fork(self) -> None:
+        # Waiting threads only exist in the parent.
+        self.pending = None
+        self.in_flight = False
+        self.condition = threading.Condition()
+
+    def get(self, key: str) -> typing.Any:
+        with self.condition:
+            batch = self.pending
+            if batch is None or len(batch.keys) >= self.max_batch:
+                batch = self.pending = _Batch()
+            batch.keys[key] = None
+            leader = not batch.has_leader
+            batch.has_leader = True
+            if leader:
+                if self.window:
+                    self.condition.wait_for(lambda: len(batch.keys) >= self.max_batch, self.window)
+                self.condition.wait_for(lambda: not self.in_flight)
+                if self.pending is batch:
+                    self.pending = None
+                self.in_flight = True
+            elif len(batch.keys) >= self.max_batch:
+                self.condition.notify_all()
+
+        if leader:
+            self._fetch(batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[key]
+
+    def _fetch(self, batch):
+        keys = list(batch.keys)
+        try:
+            batch.results = dict(zip(keys, self.fetch_many(keys)))
+        except Exception as exc:
+            batch.error = exc
+        finally:
+            with self.condition:
+                self.in_flight = False
+                self.condition.notify_all()
+            batch.done.set()
+        if metrics.sink.enabled:
+            metrics.sink.increment('session_load_batches')
+            metrics.sink.increment('session_load_batch_keys', len(keys))
@@ -0,0 +1,129 @@
+"""
+Payload compression for stored sessions.
+
+Compressed payloads start with a one byte format flag. Uncompressed pickles
+always start with the pickle protocol opcode, so both kinds of payload can
+be stored side by side. zlib payloads and zstd payloads compressed without a
+dictionary can be read back by any store configuration. zstd frames record the
+ID of the dictionary they were compressed with, and can only be read by a
+store that has that dictionary.
+"""
+import threading
+import typing
+import zlib
+
+from apistar_contrib.compat import zstandard
+
+ZLIB_FLAG = b'\x01'
+ZSTD_FLAG = b'\x02'
+
+
+class Compressor(object):
+    flag = b''
+
+    def compress(self, value: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, value: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class ZlibCompressor(Compressor):
+    flag = ZLIB_FLAG
+
+    def __init__(self, level: int=6) -> None:
+        self.level = level
+
+    def compress(self, value: bytes) -> bytes:
+        return zlib.compress(value, self.level)
+
+    def decompress(self, value: bytes) -> bytes:
+        return zlib.decompress(value)
+
+
+class ZstdCompressor(Compressor):
+    """
+    Zstandard compression, optionally with a dictionary trained on typical
+    session payloads (see `train_zstd_dictionary`), which is what makes zstd
+    worthwhile on small payloads. Payloads compressed with a dictionary that
+    was replaced can still be read if it is in `previous_dictionaries`.
+    """
+    flag = ZSTD_FLAG
+
+    def __init__(self, level: int=3, dictionary: bytes=None,
+                 previous_dictionaries: typing.Sequence[bytes]=()) -> None:
+        assert zstandard is not None, 'zstandard must be installed'
+        self.level = level
+        self.dictionary = None
+        # Dictionaries that can be decompressed with, by their ID.
+        self.dictionaries = {}  # type: typing.Dict[int, zstandard.ZstdCompressionDict]
+        for data in previous_dictionaries:
+            previous = zstandard.ZstdCompressionDict(data)
+            self.dictionaries[previous.dict_id()] = previous
+        if dictionary is not None:
+            self.dictionary = zstandard.ZstdCompressionDict(dictionary)
+            self.dictionary.precompute_compress(level=level)
+            self.dictionaries[self.dictionary.dict_id()] = self.dictionary
+        # zstandard (de)compressor objects must not be shared between threads.
+        self.local = threading.local()
+
+    def compress(self, value: bytes) -> bytes:
+        try:
+            compressor = self.local.compressor
+        except AttributeError:
+            compressor = self.local.compressor = zstandard.ZstdCompressor(
+                level=self.level, dict_data=self.dictionary)
+        return compressor.compress(value)
+
+    def decompress(self, value: bytes) -> bytes:
+        dict_id = zstandard.get_frame_parameters(value).dict_id
+        try:
+            decompressors = self.local.decompressors
+        except AttributeError:
+            decompressors = self.local.decompressors = {}
+        decompressor = decompressors.get(dict_id)
+        if decompressor is None:
+            if dict_id and dict_id not in self.dictionaries:
+                raise ValueError('Payload was compressed with zstd dictionary %d, which is not configured' % dict_id)
+            decompressor = decompressors[dict_id] = zstandard.ZstdDecompressor(
+                dict_data=self.dictionaries.get(dict_id))
+        return decompressor.decompress(value)
+
+
+def get_compressor(compression: typing.Union[str, Compressor]=None, **options) -> typing.Optional[Compressor]:
+    if compression is None or isinstance(compression, Compressor):
+        return compression
+    compressors = {'zlib': ZlibCompressor, 'zstd': ZstdCompressor}
+    assert compression in compressors, 'compression must be one of %s' % ', '.join(sorted(compressors))
+    return compressors[compression](**options)
+
+
+def compress(value: bytes, compressor: Compressor, threshold: int) -> bytes:
+    """
+    Compress payloads of at least `threshold` bytes, keeping the original
+    when compression does not make it smaller.
+    """
+    if len(value) < threshold:
+        return value
+    compressed = compressor.flag + compressor.compress(value)
+    return compressed if len(compressed) < len(value) else value
+
+
+def decompress(value: bytes, compressor: Compressor=None) -> bytes:
+    flag = value[:1]
+    if flag == ZLIB_FLAG:
+        return zlib.decompress(value[1:])
+    elif flag == ZSTD_FLAG:
+        if not isinstance(compressor, ZstdCompressor):
+            compressor = ZstdCompressor()
+        return compressor.decompress(value[1:])
+    return value
+
+
+def train_zstd_dictionary(samples: typing.List[bytes], size: int=16384) -> bytes:
+    """
+    Train a zstd dictionary from sample session payloads, as produced by
+    `RedisSessionStore.encode` with compression disabled.
+    """
+    assert zstandard is not None, 'zstandard must be installed'
+    return zstandard.train_dictionary(size, samples).as_bytes()
@@ -1,21 +1,47 @@
+import time
 import typing
 
 from apistar_contrib.sessions import Session, SessionStore
 
 local_memory_sessions = {}  # type: typing.Dict[str, typing.Dict[str, typing.Any]]
+local_memory_last_used = {}  # type: typing.Dict[str, float]
 
 
 class LocalMemorySessionStore(SessionStore):
+    backend = 'local'
+
     def load(self, session_id: str) -> Session:
         try:
             data = local_memory_sessions[session_id]
         except KeyError:
             return self.new()
+        local_memory_last_used[session_id] = time.time()
         return Session(self, session_id=session_id, data=data)
 
     def save(self, session: Session):
-        if session.is_cleared:
+        if not (session.is_new or session.is_modified or session.is_cleared or session.is_rotated):
+            return False
+        if session.is_cleared or session.is_rotated:
             local_memory_sessions.pop(session.session_id, None)
+            local_memory_last_used.pop(session.session_id, None)
             session.session_id = self._generate_key()
-        if session.is_new or session.is_modified or session.is_cleared:
-            local_memory_sessions[session.session_id] = session.data
+        local_memory_sessions[session.session_id] = session.data
+        local_memory_last_used[session.session_id] = time.time()
+        session.is_cleared = session.is_rotated = False
+        return True
+
+    def iter_session_ids(self, batch_size: int=1000) -> typing.Iterator[str]:
+        # Copy the keys, so sessions can be purged while iterating.
+        return iter(list(local_memory_sessions))
+
+    def delete_many(self, session_ids: typing.Sequence[str]) -> None:
+        for session_id in session_ids:
+            local_memory_sessions.pop(session_id, None)
+            local_memory_last_used.pop(session_id, None)
+
+    def idle_times(self, session_ids: typing.Sequence[str]) -> typing.List[typing.Optional[float]]:
+        now = time.time()
+        return [
+            now - local_memory_last_used[session_id] if session_id in local_memory_last_used else None
+            for session_id in session_ids
+        ]
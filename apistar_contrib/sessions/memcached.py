@@ -0,0 +1,163 @@
+import re
+import time
+import typing
+
+from apistar_contrib import forksafe, metrics
+from apistar_contrib.compat import pymemcache, pickle, PICKLE_VERSION
+from apistar_contrib.sessions.base import Session, SessionConflict, SessionStore
+from apistar_contrib.sessions.coalesce import LoadCoalescer
+
+# memcached reads expiry times above 30 days as Unix timestamps.
+RELATIVE_EXPIRY_LIMIT = 60 * 60 * 24 * 30
+
+# Session IDs that can be used in a memcached key, anything else comes from
+# a forged cookie and is treated as a missing session.
+SESSION_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,200}\Z')
+
+
+class MemcachedSessionStore(SessionStore):
+    """
+    Sessions spread over memcached `servers` by rendezvous hashing, so adding
+    or removing a server only moves the sessions that were on it. Each save is
+    a compare-and-set against the CAS token of the load, and concurrent writes
+    are merged like versioned Redis sessions.
+    """
+    backend = 'memcached'
+
+    def __init__(self, servers: typing.Sequence[typing.Union[str, typing.Tuple[str, int]]],
+                 pool_size: int=None, timeout: float=None, max_merge_attempts: int=5,
+                 coalesce_loads: bool=False, coalesce_options: dict=None,
+                 client_options: dict=None, **kwargs):
+        assert pymemcache is not None, 'pymemcache must be installed'
+        assert servers, 'at least one server is required'
+        self.servers = list(servers)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.client_options = client_options or {}
+        self.client = self._connect()
+        self.max_merge_attempts = max_merge_attempts
+        if coalesce_loads:
+            self.coalescer = LoadCoalescer(self._fetch, **(coalesce_options or {}))
+        else:
+            self.coalescer = None
+        super().__init__(**kwargs)
+        forksafe.register(self)
+
+    def _connect(self):
+        options = {
+            'use_pooling': True,
+            'max_pool_size': self.pool_size,
+            'connect_timeout': self.timeout,
+            'timeout': self.timeout,
+            # Stores must report whether they happened for CAS to work.
+            'default_noreply': False,
+        }
+        options.update(self.client_options)
+        return pymemcache.HashClient(self.servers, **options)
+
+    def after_fork(self):
+        # The pooled sockets are shared with the parent, start with new ones.
+        self.client = self._connect()
+        if self.coalescer is not None:
+            self.coalescer.after_fork()
+
+    def get_key(self, session_id):
+        return 'session:{}'.format(session_id)
+
+    def get_expiry(self) -> int:
+        """
+        Seconds until a saved session expires, following `cookie_age`.
+        Zero means never.
+        """
+        cookie_age = self.session_settings.cookie_age
+        if cookie_age is None:
+            return 0
+        if cookie_age > RELATIVE_EXPIRY_LIMIT:
+            return int(time.time()) + cookie_age
+        return cookie_age
+
+    def load(self, session_id: str) -> Session:
+        if not SESSION_ID_PATTERN.match(session_id):
+            return self.new()
+        key = self.get_key(session_id)
+        if self.coalescer is not None:
+            value, cas = self.coalescer.get(key)
+        else:
+            value, cas = self._fetch([key])[0]
+        if value is None:
+            return self.new()
+        return self._load_session(session_id, value, cas)
+
+    def _fetch(self, keys):
+        # A single `gets` per server, for every key that hashes to it.
+        found = self.client.gets_many(keys)
+        return [found.get(key, (None, None)) for key in keys]
+
+    def _load_session(self, session_id, value, cas):
+        return Session(self, session_id=session_id, data=pickle.loads(value), version=int(cas))
+
+    def save(self, session: Session) -> bool:
+        if not (session.is_new or session.is_modified or session.is_cleared or session.is_rotated):
+            return False
+
+        old_key = None
+        if session.is_cleared or session.is_rotated:
+            if not session.is_new:
+                old_key = self.get_key(session.session_id)
+            session.session_id = self._generate_key()
+            session.version = None
+        written = self._write(session)
+        if old_key is not None:
+            self.client.delete(old_key)
+        session.is_cleared = session.is_rotated = False
+        return written
+
+    def _write(self, session):
+        key = self.get_key(session.session_id)
+        expire = self.get_expiry()
+        for attempt in range(self.max_merge_attempts):
+            value = pickle.dumps(session.data, PICKLE_VERSION)
+            if session.version is None:
+                # Nothing was loaded, so only write if nothing is stored.
+                stored = self.client.add(key, value, expire)
+            else:
+                stored = self.client.cas(key, value, session.version, expire)
+            if stored:
+                if metrics.sink.enabled:
+                    metrics.sink.increment('session_serialized_bytes', len(value), store=self.backend)
+                # memcached doesn't return the new token, a later save of this
+                # session merges onto what it finds.
+                session.version = None
+                return True
+            # Someone else saved first, rebase our changes on theirs and retry.
+            if metrics.sink.enabled:
+                metrics.sink.increment('session_write_conflicts', store=self.backend)
+            value, cas = self._fetch([key])[0] if stored is not None else (None, None)
+            if value is None:
+                # Deleted since it was loaded (logout, `delete_many`), which
+                # must not be undone by writing it back.
+                if metrics.sink.enabled:
+                    metrics.sink.increment('session_writes_dropped', store=self.backend)
+                return False
+            session.merge(pickle.loads(value), int(cas))
+        raise SessionConflict('Could not save session after %d attempts' % self.max_merge_attempts)
+
+    # memcached can't list its keys, so only `load_many` and `delete_many`
+    # are available for administration.
+
+    def load_many(self, session_ids: typing.Sequence[str]) -> typing.List[typing.Optional[Session]]:
+        valid_ids = [session_id for session_id in session_ids if SESSION_ID_PATTERN.match(session_id)]
+        values = dict(zip(valid_ids, self._fetch([self.get_key(session_id) for session_id in valid_ids])))
+        sessions = []
+        for session_id in session_ids:
+            value, cas = values.get(session_id, (None, None))
+            if value is None:
+                sessions.append(None)
+            else:
+                sessions.append(self._load_session(session_id, value, cas))
+        return sessions
+
+    def delete_many(self, session_ids: typing.Sequence[str]) -> None:
+        self.client.delete_many([
+            self.get_key(session_id) for session_id in session_ids if SESSION_ID_PATTERN.match(session_id)
+        ])
@@ -1,45 +1,614 @@
+import hashlib
+import logging
+import threading
+import typing
+from collections import OrderedDict
+from time import monotonic
+
+from apistar_contrib import forksafe, metrics
 from apistar_contrib.compat import redis, pickle, PICKLE_VERSION
-from apistar_contrib.sessions.base import Session, SessionStore
+from apistar_contrib.sessions.compression import compress, decompress, get_compressor
+from apistar_contrib.sessions.base import Session, SessionConflict, SessionStore
+from apistar_contrib.sessions.circuit import CircuitBreaker, CircuitOpen
+from apistar_contrib.sessions.coalesce import LoadCoalescer
+from apistar_contrib.sessions.replicas import ROUND_ROBIN, RecentWrites, ReplicaSelector
+from apistar_contrib.sessions.writebehind import NOT_SET, WriteBatch, WriteBehindQueue
+
+
+# Compare-and-set for versioned sessions, stored as a hash of `data` and
+# `version`. Returns the new version, or -1 if another request won the race.
+CAS_SCRIPT = """
+local version = tonumber(redis.call('HGET', KEYS[1], 'version') or '0')
+if version ~= tonumber(ARGV[1]) then
+    return -1
+end
+redis.call('HSET', KEYS[1], 'data', ARGV[2], 'version', version + 1)
+return version + 1
+"""
+
+# Move a session to a new ID, keeping its TTL. Returns 0 if there was
+# nothing stored under the old ID.
+ROTATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+return 1
+"""
+
+# Add a session to an owner index, and drop the sessions listed there that
+# no longer exist. The index has no TTL of its own, like the sessions.
+ADD_OWNER_SCRIPT = """
+redis.call('SADD', KEYS[1], ARGV[2])
+for _, session_id in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    if session_id ~= ARGV[2] and redis.call('EXISTS', ARGV[1] .. session_id) == 0 then
+        redis.call('SREM', KEYS[1], session_id)
+    end
+end
+"""
+
+# Delete every session listed in an owner index, and the index itself.
+INVALIDATE_OWNER_SCRIPT = """
+local session_ids = redis.call('SMEMBERS', KEYS[1])
+for _, session_id in ipairs(session_ids) do
+    redis.call('DEL', ARGV[1] .. session_id)
+end
+redis.call('DEL', KEYS[1])
+return #session_ids
+"""
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_LOCAL = 'local'
+FALLBACK_ANONYMOUS = 'anonymous'
+
+
+def get_digests(data: typing.Dict[str, typing.Any]) -> typing.Dict[str, bytes]:
+    # Each value is pickled on its own, so changes can be told apart by key.
+    return {key: hashlib.sha1(pickle.dumps(value, PICKLE_VERSION)).digest() for key, value in data.items()}
+
+
+class PayloadDigests(object):
+    """
+    Digest of a pickled session payload as it was loaded or saved. Digests of
+    each value are only computed, from the kept payload, once the payload
+    differs.
+    """
+    __slots__ = ('digest', 'payload', '_by_key')
+
+    def __init__(self, payload: bytes) -> None:
+        self.digest = hashlib.sha1(payload).digest()
+        self.payload = payload
+        self._by_key = None  # type: typing.Dict[str, bytes]
+
+    def by_key(self) -> typing.Dict[str, bytes]:
+        if self._by_key is None:
+            self._by_key = get_digests(pickle.loads(self.payload))
+        return self._by_key
 
 
 class RedisSessionStore(SessionStore):
-    def __init__(self, redis_url, **kwargs):
+    backend = 'redis'
+
+    def __init__(self, redis_url, write_behind: bool=False, write_behind_options: dict=None,
+                 versioned: bool=False, max_merge_attempts: int=5,
+                 compression: str=None, compression_threshold: int=1024, compression_options: dict=None,
+                 owner_key: str=None, detect_changes: bool=False,
+                 timeout: float=None, circuit_breaker: bool=False, circuit_breaker_options: dict=None,
+                 fallback: str=None, fallback_size: int=10000,
+                 replica_urls: typing.Sequence[str]=None, replica_strategy: str=ROUND_ROBIN,
+                 replica_options: dict=None, read_your_writes_window: float=1.0,
+                 coalesce_loads: bool=False, coalesce_options: dict=None,
+                 prewarm_connections: int=1, **kwargs):
         assert redis is not None, 'redis must be installed'
-        self.client = redis.StrictRedis.from_url(redis_url)
+        assert not (versioned and write_behind), 'versioned sessions cannot be written behind'
+        # A stale read from a lagging replica must not be written back over newer data.
+        assert versioned or not replica_urls, 'replica reads require versioned sessions'
+        assert fallback in (None, FALLBACK_LOCAL, FALLBACK_ANONYMOUS), 'unknown fallback %r' % fallback
+        self.timeout = timeout
+        self.client = self._connect(redis_url)
+        if replica_urls:
+            self.replicas = ReplicaSelector([self._connect(url) for url in replica_urls], replica_strategy,
+                                            **(replica_options or {}))
+            self.recent_writes = RecentWrites(read_your_writes_window)
+        else:
+            self.replicas = None
+            self.recent_writes = None
+        self.versioned = versioned
+        self.max_merge_attempts = max_merge_attempts
+        self.cas_script = self.client.register_script(CAS_SCRIPT) if versioned else None
+        self.rotate_script = self.client.register_script(ROTATE_SCRIPT)
+        self.compressor = get_compressor(compression, **(compression_options or {}))
+        self.compression_threshold = compression_threshold
+        self.owner_key = owner_key
+        self.detect_changes = detect_changes
+        self.invalidate_script = self.client.register_script(INVALIDATE_OWNER_SCRIPT) if owner_key else None
+        self.add_owner_script = self.client.register_script(ADD_OWNER_SCRIPT) if owner_key else None
+        if write_behind:
+            self.write_queue = WriteBehindQueue(self._write_batch, **(write_behind_options or {}))
+        else:
+            self.write_queue = None
+        if coalesce_loads:
+            self.coalescer = LoadCoalescer(self._fetch, **(coalesce_options or {}))
+        else:
+            self.coalescer = None
+        if circuit_breaker:
+            self.breaker = CircuitBreaker('redis_sessions', (redis.RedisError,), **(circuit_breaker_options or {}))
+        else:
+            self.breaker = None
+        self.fallback = fallback
+        self.fallback_size = fallback_size
+        self.fallback_errors = (redis.RedisError, CircuitOpen) if fallback is not None else ()
+        # Sessions saved while degraded, by ID: [source ID, changed keys or None, data].
+        self.degraded_sessions = OrderedDict()  # type: typing.Dict[str, list]
+        self.degraded_lock = threading.Lock()
+        self.reconcile_lock = threading.Lock()
+        self.reconcile_thread = None  # type: threading.Thread
+        self.prewarm_connections = prewarm_connections
         super().__init__(**kwargs)
+        forksafe.register(self)
+
+    def _connect(self, redis_url):
+        if self.timeout is not None:
+            # Deadline for connecting and for each command.
+            return redis.StrictRedis.from_url(redis_url, socket_timeout=self.timeout,
+                                              socket_connect_timeout=self.timeout)
+        return redis.StrictRedis.from_url(redis_url)
 
     def get_key(self, session_id):
         return 'session:{}'.format(session_id)
 
+    def get_owner_key(self, owner):
+        return 'session_owner:{}'.format(owner)
+
     def load(self, session_id: str) -> Session:
+        try:
+            if self.degraded_sessions:
+                self._call(self._reconcile, session_id)
+            return self._call(self._load, session_id)
+        except self.fallback_errors:
+            return self._load_degraded(session_id)
+
+    def save(self, session: Session):
+        session_id = session.session_id
+        try:
+            return self._call(self._save, session)
+        except self.fallback_errors:
+            session.session_id = session_id
+            return self._save_degraded(session)
+
+    def _call(self, func, *args):
+        if self.breaker is not None:
+            result = self.breaker.call(func, *args)
+        else:
+            result = func(*args)
+        if self.degraded_sessions:
+            self._start_reconcile()
+        return result
+
+    def _start_reconcile(self):
+        # Write degraded sessions back in the background, so the first
+        # requests after an outage don't wait on it.
+        thread = self.reconcile_thread
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(target=self._reconcile_all, name='session-reconcile', daemon=True)
+        self.reconcile_thread = thread
+        thread.start()
+
+    def _reconcile_all(self):
+        while self.degraded_sessions and self.reconcile():
+            pass
+
+    def _load(self, session_id: str) -> Session:
         key = self.get_key(session_id)
-        if not self.client.exists(key):
+        if self.write_queue is not None:
+            pending = self.write_queue.get(key)
+            if pending is None:
+                return self.new()
+            elif pending is not NOT_SET:
+                return self._load_session(session_id, pending)
+
+        if self.coalescer is not None and (self.recent_writes is None or session_id not in self.recent_writes):
+            data, version = self.coalescer.get(key)
+        elif self.replicas is None or session_id in self.recent_writes:
+            data, version = self._fetch_from(self.client, [key])[0]
+        else:
+            data, version = self._fetch([key])[0]
+        if data is None:
             return self.new()
-        data = self.client.get(key)
-        return Session(self, session_id=session_id,
-                       data=self.decode(data))
+        return self._load_session(session_id, data, version)
 
-    def save(self, session: Session):
-        if session.is_cleared:
-            self.client.delete(
-                self.get_key(session.session_id)
-            )
+    def _fetch(self, keys):
+        # Read from a replica if there are any, falling back to the primary.
+        if self.replicas is None:
+            return self._fetch_from(self.client, keys)
+        index, client = self.replicas.choose()
+        if client is None:
+            return self._fetch_from(self.client, keys)
+        start = monotonic()
+        try:
+            values = self._fetch_from(client, keys)
+        except redis.RedisError:
+            self.replicas.record_error(index)
+            return self._fetch_from(self.client, keys)
+        self.replicas.record(index, monotonic() - start)
+        # A session missing on a replica may not have been replicated yet,
+        # and mustn't log its user out.
+        missing = [position for position, (data, version) in enumerate(values) if data is None]
+        if missing:
+            found = self._fetch_from(self.client, [keys[position] for position in missing])
+            for position, value in zip(missing, found):
+                values[position] = value
+        return values
+
+    def _fetch_from(self, client, keys):
+        if not self.versioned:
+            return [(value, None) for value in client.mget(keys)]
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, 'data', 'version')
+        return [(data, None if version is None else int(version)) for data, version in pipe.execute()]
+
+    def _fetch_untouched(self, keys):
+        # Reads for administration must not reset the idle times that
+        # `purge` relies on. CLIENT NO-TOUCH needs Redis 7.2, older servers
+        # reject it and the keys are touched.
+        pipe = self.client.pipeline(transaction=False)
+        pipe.execute_command('CLIENT', 'NO-TOUCH', 'ON')
+        if self.versioned:
+            for key in keys:
+                pipe.hmget(key, 'data', 'version')
+        else:
+            pipe.mget(keys)
+        pipe.execute_command('CLIENT', 'NO-TOUCH', 'OFF')
+        results = pipe.execute(raise_on_error=False)[1:-1]
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        if not self.versioned:
+            return [(value, None) for value in results[0]]
+        return [(data, None if version is None else int(version)) for data, version in results]
+
+    def _save(self, session: Session):
+        data = session.data
+        payload = self._detect_changes(session)
+        if not (session.is_new or session.is_modified or session.is_cleared or session.is_rotated):
+            return False
+
+        old_session_id = session.session_id
+        old_key = None
+        if session.is_cleared or session.is_rotated:
             session.session_id = self._generate_key()
-        if session.is_new or session.is_modified or session.is_cleared:
-            self.client.set(
-                self.get_key(session.session_id),
-                self.encode(session.data)
-            )
+            if not session.is_new:
+                old_key = self.get_key(old_session_id)
+        key = self.get_key(session.session_id)
+
+        if old_key is not None and not (session.is_modified or session.is_cleared) and self.write_queue is None:
+            # Unchanged data only needs to be moved to the new ID.
+            moved = self.rotate_script(keys=[old_key, key])
+        else:
+            moved = False
+        if not moved:
+            if payload is None:
+                payload = pickle.dumps(session.data, PICKLE_VERSION)
+            value = self.compress(payload)
+            if metrics.sink.enabled:
+                metrics.sink.increment('session_serialized_bytes', len(value), store=self.backend)
+            if self.versioned:
+                if not self._write_versioned(session, value, old_key):
+                    session.is_cleared = session.is_rotated = False
+                    return False
+            else:
+                self._write(key, value, old_key)
+
+        if self.owner_key is not None:
+            self._update_owner_index(session, old_session_id)
+        if self.recent_writes is not None:
+            self.recent_writes.add(session.session_id)
+        if self.detect_changes:
+            if payload is None or session.data is not data:
+                # Versioned saves may have merged in other changes.
+                payload = pickle.dumps(session.data, PICKLE_VERSION)
+            session.digests = PayloadDigests(payload)
+        session.is_cleared = session.is_rotated = False
+        return True
+
+    def _detect_changes(self, session):
+        if session.digests is None or session.is_cleared:
+            return None
+        # Decide by content, so in-place changes are written and
+        # assignments of equal values are not. Only the keys whose values
+        # changed win a merge. The payload is pickled once, and only
+        # compared value by value if it differs as a whole.
+        payload = pickle.dumps(session.data, PICKLE_VERSION)
+        if hashlib.sha1(payload).digest() == session.digests.digest:
+            changed_keys = set()
+        else:
+            loaded = session.digests.by_key()
+            digests = get_digests(session.data)
+            changed_keys = {key for key, digest in digests.items() if loaded.get(key) != digest}
+            changed_keys.update(key for key in loaded if key not in digests)
+        session.changed_keys = changed_keys
+        session.is_modified = bool(changed_keys)
+        return payload
+
+    def reconcile(self, limit: int=100) -> int:
+        """
+        Write up to `limit` sessions saved while Redis was unavailable.
+        Runs in a background thread once Redis calls succeed again. Returns
+        the number of sessions written.
+        """
+        if not self.reconcile_lock.acquire(blocking=False):
+            return 0
+        try:
+            count = 0
+            while count < limit:
+                with self.degraded_lock:
+                    if not self.degraded_sessions:
+                        break
+                    session_id = next(iter(self.degraded_sessions))
+                try:
+                    self._reconcile(session_id)
+                except redis.RedisError:
+                    logger.warning('Failed to reconcile degraded sessions, will retry', exc_info=True)
+                    break
+                except Exception:
+                    logger.exception('Dropping degraded session that could not be reconciled')
+                    continue
+                count += 1
+            return count
+        finally:
+            self.reconcile_lock.release()
+
+    def _reconcile(self, session_id):
+        with self.degraded_lock:
+            entry = self.degraded_sessions.pop(session_id, None)
+        if entry is None:
+            return
+        source_id, changed_keys, data = entry
+        try:
+            base = self._load(source_id) if source_id is not None else self.new()
+            if changed_keys is not None:
+                # Only keys changed while degraded override what Redis has.
+                for key in changed_keys:
+                    if key in data:
+                        base.data[key] = data[key]
+                    else:
+                        base.data.pop(key, None)
+                data = base.data
+            session = Session(self, session_id=session_id, data=data,
+                              version=base.version if source_id == session_id else None)
+            session.owner = base.owner if source_id == session_id else None
+            session.changed_keys = set(data) if changed_keys is None else set(changed_keys)
+            session.is_modified = True
+            self._save(session)
+            if source_id is not None and source_id != session_id:
+                self.client.delete(self.get_key(source_id))
+        except redis.RedisError:
+            with self.degraded_lock:
+                # Put it back, unless it was saved again in the meantime.
+                if session_id not in self.degraded_sessions:
+                    self.degraded_sessions[session_id] = entry
+                    self.degraded_sessions.move_to_end(session_id, last=False)
+            raise
+        if metrics.sink.enabled:
+            metrics.sink.increment('session_reconciled', store=self.backend)
+
+    def _load_degraded(self, session_id):
+        if metrics.sink.enabled:
+            metrics.sink.increment('session_degraded', store=self.backend, operation='load')
+        with self.degraded_lock:
+            entry = self.degraded_sessions.get(session_id)
+        # Keep the cookie, an empty session is served until Redis is back.
+        return Session(self, session_id=session_id, data=dict(entry[2]) if entry is not None else {})
+
+    def _save_degraded(self, session):
+        if metrics.sink.enabled:
+            metrics.sink.increment('session_degraded', store=self.backend, operation='save')
+        self._detect_changes(session)
+        if not (session.is_new or session.is_modified or session.is_cleared or session.is_rotated):
+            return False
+        if self.fallback == FALLBACK_ANONYMOUS:
+            return False
+
+        with self.degraded_lock:
+            entry = self.degraded_sessions.pop(session.session_id, None)
+            # Whether an ID sent by the client exists can't be checked, so
+            # it is never written to. The session moves to a new ID, and is
+            # merged into the stored one, if any, when reconciled.
+            unverified = entry is None and not session.is_new
+            if entry is None:
+                entry = [None if session.is_new else session.session_id, set(), None]
+            if session.is_cleared:
+                entry[1] = None
+            elif entry[1] is not None:
+                entry[1].update(session.changed_keys)
+            entry[2] = dict(session.data)
+            if session.is_cleared or session.is_rotated or unverified:
+                session.session_id = self._generate_key()
+                session.needs_cookie = True
+            self.degraded_sessions[session.session_id] = entry
+            while len(self.degraded_sessions) > self.fallback_size:
+                self.degraded_sessions.popitem(last=False)
+                if metrics.sink.enabled:
+                    metrics.sink.increment('session_degraded_dropped', store=self.backend)
+        session.is_cleared = session.is_rotated = False
+        return True
+
+    def invalidate_owner(self, owner) -> int:
+        """
+        Delete every session of `owner` in a single call, for example after a
+        password change. Returns the number of sessions that were indexed.
+        """
+        assert self.owner_key is not None, 'owner_key must be set to index sessions by owner'
+        if self.write_queue is not None:
+            # Don't let deferred writes bring invalidated sessions back.
+            self.write_queue.flush()
+        return self.invalidate_script(keys=[self.get_owner_key(owner)], args=[self.get_key('')])
+
+    def after_fork(self):
+        """
+        Reset state inherited from the parent process, and connect ahead of
+        the first request. Called in forked children by `forksafe`.
+        """
+        forksafe.reset_redis_client(self.client, self.prewarm_connections)
+        if self.replicas is not None:
+            for client in self.replicas.clients:
+                forksafe.reset_redis_client(client, self.prewarm_connections)
+        # The parent reconciles the sessions it saved while degraded.
+        self.degraded_sessions = OrderedDict()
+        self.degraded_lock = threading.Lock()
+        self.reconcile_lock = threading.Lock()
+        self.reconcile_thread = None
+        for component in (self.write_queue, self.coalescer, self.breaker, self.recent_writes):
+            if component is not None:
+                component.after_fork()
+
+    def close(self):
+        """
+        Flush any deferred writes, should be called on shutdown.
+        """
+        if self.write_queue is not None:
+            self.write_queue.close()
+
+    def _write(self, key, value, old_key=None):
+        # Writing to a new ID deletes the old key in the same round-trip.
+        if self.write_queue is not None:
+            if (old_key is None or self.write_queue.put(old_key, None)) and self.write_queue.put(key, value):
+                return
+        if old_key is None:
+            self.client.set(key, value)
+        else:
+            pipe = self.client.pipeline(transaction=True)
+            pipe.delete(old_key)
+            pipe.set(key, value)
+            pipe.execute()
+
+    def iter_session_ids(self, batch_size: int=1000) -> typing.Iterator[str]:
+        # SCAN walks the keyspace in small steps instead of blocking Redis.
+        if self.write_queue is not None:
+            self.write_queue.flush()
+        prefix = self.get_key('')
+        cursor = None
+        while cursor != 0:
+            cursor, keys = self.client.scan(cursor or 0, match=prefix + '*', count=batch_size)
+            # SCAN may return a key more than once, drop the repeats within a
+            # batch. Keys can still repeat across batches if Redis resizes its
+            # keyspace while we walk it.
+            for key in OrderedDict.fromkeys(keys):
+                yield key.decode()[len(prefix):]
+
+    def load_many(self, session_ids: typing.Sequence[str]) -> typing.List[typing.Optional[Session]]:
+        keys = [self.get_key(session_id) for session_id in session_ids]
+        values = self._fetch_untouched(keys)
+
+        sessions = []
+        for session_id, key, (data, version) in zip(session_ids, keys, values):
+            if self.write_queue is not None:
+                pending = self.write_queue.get(key)
+                if pending is not NOT_SET:
+                    data = pending
+            if data is None:
+                sessions.append(None)
+            else:
+                sessions.append(self._load_session(session_id, data, version))
+        return sessions
+
+    def delete_many(self, session_ids: typing.Sequence[str]) -> None:
+        # Owner indexes are not updated here, stale entries are pruned on
+        # the owner's next index update.
+        if self.write_queue is not None:
+            self.write_queue.flush()
+        self.client.delete(*[self.get_key(session_id) for session_id in session_ids])
+
+    def idle_times(self, session_ids: typing.Sequence[str]) -> typing.List[typing.Optional[float]]:
+        pipe = self.client.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipe.object('idletime', self.get_key(session_id))
+        return pipe.execute()
+
+    def _load_session(self, session_id, data, version=None):
+        payload = decompress(data, self.compressor)
+        session = Session(self, session_id=session_id, data=pickle.loads(payload), version=version)
+        if self.detect_changes:
+            session.digests = PayloadDigests(payload)
+        if self.owner_key is not None:
+            session.owner = session.data.get(self.owner_key)
+        return session
+
+    def _update_owner_index(self, session, old_session_id):
+        owner = session.data.get(self.owner_key)
+        if not session.is_new and session.session_id == old_session_id and owner == session.owner:
+            # Already listed under this owner.
+            return
+        pipe = self.client.pipeline(transaction=False)
+        if session.owner is not None and (owner != session.owner or session.session_id != old_session_id):
+            pipe.srem(self.get_owner_key(session.owner), old_session_id)
+        if owner is not None:
+            owner_key = self.get_owner_key(owner)
+            if self.write_queue is None:
+                self.add_owner_script(keys=[owner_key], args=[self.get_key(''), session.session_id], client=pipe)
+            else:
+                # Other sessions of this owner may not be written yet, so
+                # nothing can be pruned.
+                pipe.sadd(owner_key, session.session_id)
+        if len(pipe):
+            pipe.execute()
+        session.owner = owner
+
+    def _write_versioned(self, session, value, old_key=None):
+        key = self.get_key(session.session_id)
+        if old_key is not None:
+            session.version = None
+        for attempt in range(self.max_merge_attempts):
+            if old_key is not None:
+                pipe = self.client.pipeline(transaction=True)
+                pipe.delete(old_key)
+                self.cas_script(keys=[key], args=[0, value], client=pipe)
+                version = pipe.execute()[-1]
+                old_key = None
+            else:
+                version = self.cas_script(keys=[key], args=[session.version or 0, value])
+            if version >= 0:
+                session.version = version
+                return True
+            # Someone else saved first, rebase our changes on theirs and retry.
+            if metrics.sink.enabled:
+                metrics.sink.increment('session_write_conflicts', store=self.backend)
+            data, version = self.client.hmget(key, 'data', 'version')
+            if data is None:
+                # Deleted since it was loaded (logout, invalidation), which
+                # must not be undone by writing it back.
+                if metrics.sink.enabled:
+                    metrics.sink.increment('session_writes_dropped', store=self.backend)
+                return False
+            session.merge(self.decode(data), int(version) if version is not None else None)
+            value = self.encode(session.data)
+        raise SessionConflict('Could not save session after %d attempts' % self.max_merge_attempts)
+
+    def _write_batch(self, batch: WriteBatch):
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in batch:
+            if value is None:
+                pipe.delete(key)
+            else:
+                pipe.set(key, value)
+        pipe.execute()
 
     def encode(self, value):
         if isinstance(value, bool) or not isinstance(value, int):
-            value = pickle.dumps(value, PICKLE_VERSION)
-            return value
+            return self.compress(pickle.dumps(value, PICKLE_VERSION))
         return value
 
+    def compress(self, payload: bytes) -> bytes:
+        if self.compressor is not None:
+            return compress(payload, self.compressor, self.compression_threshold)
+        return payload
+
     def decode(self, value):
         try:
             value = int(value)
         except (ValueError, TypeError):
-            value = pickle.loads(value)
+            value = pickle.loads(decompress(value, self.compressor))
         return value
@@ -0,0 +1,87 @@
+import itertools
+import threading
+import typing
+from collections import OrderedDict
+from time import monotonic
+
+ROUND_ROBIN = 'round_robin'
+LEAST_LATENCY = 'least_latency'
+
+
+class ReplicaSelector(object):
+    """
+    Picks the replica to read from, either in turn or the one with the
+    lowest moving average latency. A failed replica is skipped for
+    `error_timeout` seconds, then gets a single trial read with its latency
+    reset to the best one, and is skipped again if that fails too.
+    """
+
+    def __init__(self, clients: typing.Sequence, strategy: str=ROUND_ROBIN,
+                 smoothing: float=0.2, error_timeout: float=5.0) -> None:
+        assert clients, 'at least one replica is required'
+        assert strategy in (ROUND_ROBIN, LEAST_LATENCY), 'unknown replica strategy %r' % strategy
+        self.clients = list(clients)
+        self.strategy = strategy
+        self.smoothing = smoothing
+        self.error_timeout = error_timeout
+        self.latencies = [0.0] * len(self.clients)
+        # When each failed replica may be tried again, None if it is healthy.
+        self.failed_until = [None] * len(self.clients)  # type: typing.List[typing.Optional[float]]
+        self.counter = itertools.count()
+
+    def choose(self) -> typing.Tuple[typing.Optional[int], typing.Any]:
+        """
+        Returns the index and client of the replica to read from, or
+        `(None, None)` while every replica is failing.
+        """
+        now = monotonic()
+        available = [index for index, failed_until in enumerate(self.failed_until) if failed_until is None]
+        for index, failed_until in enumerate(self.failed_until):
+            if failed_until is not None and failed_until <= now:
+                self.failed_until[index] = None
+                self.latencies[index] = min((self.latencies[other] for other in available), default=0.0)
+                return index, self.clients[index]
+        if not available:
+            return None, None
+        if self.strategy == ROUND_ROBIN:
+            index = available[next(self.counter) % len(available)]
+        else:
+            index = min(available, key=self.latencies.__getitem__)
+        return index, self.clients[index]
+
+    def record(self, index: int, seconds: float) -> None:
+        self.latencies[index] += self.smoothing * (seconds - self.latencies[index])
+
+    def record_error(self, index: int) -> None:
+        self.failed_until[index] = monotonic() + self.error_timeout
+
+
+class RecentWrites(object):
+    """
+    Session IDs written in the last `window` seconds by this process, whose
+    reads should go to the primary until the replicas have caught up.
+    """
+
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self.deadlines = OrderedDict()  # type: typing.Dict[str, float]
+        self.lock = threading.Lock()
+
+    def after_fork(self) -> None:
+        self.lock = threading.Lock()
+
+    def __contains__(self, session_id: str) -> bool:
+        deadline = self.deadlines.get(session_id)
+        return deadline is not None and deadline > monotonic()
+
+    def add(self, session_id: str) -> None:
+        now = monotonic()
+        with self.lock:
+            self.deadlines.pop(session_id, None)
+            self.deadlines[session_id] = now + self.window
+            # Deadlines are in insertion order, so expired IDs are at the front.
+            while self.deadlines:
+                oldest = next(iter(self.deadlines))
+                if self.deadlines[oldest] > now:
+                    break
+                del self.deadlines[oldest]
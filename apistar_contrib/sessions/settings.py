@@ -1,7 +1,10 @@
 import typing
+from collections import namedtuple
 
 from apistar import types, validators
 
+from apistar_contrib.cookies import CookieSpec
+
 
 # Settings for Session
 class SessionSettings(types.Type):
@@ -14,3 +17,23 @@ class SessionSettings(types.Type):
 
 
 SettingsMapping = typing.Mapping[str, typing.Union[str, int, bool]]
+
+# Validated settings snapshot used on the request path, plus the precompiled cookie.
+FrozenSessionSettings = namedtuple(
+    'FrozenSessionSettings', list(SessionSettings.validator.properties) + ['cookie'])
+
+
+def freeze_settings(settings: typing.Union[SessionSettings, SettingsMapping]=None) -> FrozenSessionSettings:
+    if isinstance(settings, FrozenSessionSettings):
+        return settings
+    if not isinstance(settings, SessionSettings):
+        settings = SessionSettings(settings or {})
+    cookie = CookieSpec(
+        settings.cookie_name,
+        max_age=settings.cookie_age,
+        domain=settings.cookie_domain,
+        path=settings.cookie_path,
+        secure=settings.cookie_secure,
+        httponly=settings.cookie_httponly,
+    )
+    return FrozenSessionSettings(cookie=cookie, **settings._dict)
@@ -0,0 +1,145 @@
+import atexit
+import logging
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+from apistar_contrib import metrics
+
+logger = logging.getLogger(__name__)
+
+NOT_SET = object()
+
+WriteBatch = typing.List[typing.Tuple[str, typing.Any]]
+
+
+class WriteBehindQueue(object):
+    """
+    Defers session writes to a background thread.
+
+    Writes are keyed, so repeated writes to the same key within the flush
+    window are coalesced into one. Pending writes are handed to `flush` in
+    batches of up to `batch_size`. When `max_size` writes are pending, `put`
+    blocks for up to `put_timeout` seconds and then returns False, so the
+    caller can fall back to writing synchronously.
+    """
+
+    def __init__(self, flush: typing.Callable[[WriteBatch], None], max_size: int=10000,
+                 window: float=0.01, batch_size: int=100, put_timeout: float=1.0) -> None:
+        self.flush_batch = flush
+        self.max_size = max_size
+        self.window = window
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+
+        self.pending = OrderedDict()  # type: typing.Dict[str, typing.Any]
+        self.in_flight = {}  # type: typing.Dict[str, typing.Any]
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.closed = False
+
+        self.thread = threading.Thread(target=self._run, name='session-write-behind', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def after_fork(self) -> None:
+        """
+        Threads don't survive a fork, start a new one. Pending writes are
+        left to the parent, which still has them.
+        """
+        self.pending = OrderedDict()
+        self.in_flight = {}
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='session-write-behind', daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, key: str, value: typing.Any) -> bool:
+        with self.condition:
+            if self.closed:
+                return False
+            if key in self.pending:
+                self.pending[key] = value
+                if metrics.sink.enabled:
+                    metrics.sink.increment('session_write_behind_coalesced')
+                return True
+
+            deadline = time.monotonic() + self.put_timeout
+            while len(self.pending) >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.closed:
+                    if metrics.sink.enabled:
+                        metrics.sink.increment('session_write_behind_rejected')
+                    return False
+                self.condition.wait(remaining)
+
+            self.pending[key] = value
+            self.condition.notify_all()
+            return True
+
+    def get(self, key: str, default: typing.Any=NOT_SET) -> typing.Any:
+        """
+        Return the value waiting to be written for `key`, so reads made
+        before the flush still see the latest write.
+        """
+        with self.condition:
+            if key in self.pending:
+                return self.pending[key]
+            return self.in_flight.get(key, default)
+
+    def flush(self) -> None:
+        """
+        Write out everything that is pending, in batches.
+        """
+        with self.flush_lock:
+            while True:
+                with self.condition:
+                    if not self.pending:
+                        return
+                    batch = []
+                    while self.pending and len(batch) < self.batch_size:
+                        batch.append(self.pending.popitem(last=False))
+                    self.in_flight.update(batch)
+                    self.condition.notify_all()
+
+                try:
+                    self.flush_batch(batch)
+                except Exception:
+                    logger.exception('Failed to write %d deferred sessions', len(batch))
+                    if metrics.sink.enabled:
+                        metrics.sink.increment('session_write_behind_errors', len(batch))
+                finally:
+                    with self.condition:
+                        self.in_flight.clear()
+
+    def close(self, timeout: float=None) -> None:
+        """
+        Stop the background thread and flush whatever is still pending.
+        """
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                # Give writes to the same key a chance to coalesce, unless
+                # the queue is full or shutting down.
+                if self.window:
+                    self.condition.wait_for(lambda: self.closed or len(self.pending) >= self.max_size,
+                                            self.window)
+                if self.closed:
+                    return
+            self.flush()
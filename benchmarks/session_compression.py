@@ -0,0 +1,64 @@
+"""
+Size and CPU cost of session payload compression.
+
+    PYTHONPATH=. python benchmarks/session_compression.py
+
+Encodes and decodes representative sessions with each compression setting
+of `RedisSessionStore` and prints the stored size and the time per
+encode + decode round trip. No Redis server is needed.
+"""
+import random
+import timeit
+
+from apistar_contrib.compat import PICKLE_VERSION, pickle, zstandard
+from apistar_contrib.sessions import RedisSessionStore
+from apistar_contrib.sessions.compression import train_zstd_dictionary
+
+
+def make_session(rng, items):
+    return {
+        'user_id': rng.randint(1, 10 ** 6),
+        'csrf': ''.join(rng.choice('abcdef0123456789') for _ in range(32)),
+        'locale': rng.choice(['en-US', 'en-GB', 'de-DE', 'fr-FR']),
+        'cart': [
+            {'sku': 'SKU-%05d' % rng.randint(0, 99999), 'quantity': rng.randint(1, 5), 'price': '19.99'}
+            for _ in range(items)
+        ],
+        'recently_viewed': ['/products/%d' % rng.randint(0, 5000) for _ in range(items * 2)],
+    }
+
+
+def main():
+    rng = random.Random(0)
+    sessions = {
+        'small': make_session(rng, 1),
+        'medium': make_session(rng, 10),
+        'large': make_session(rng, 100),
+    }
+    settings = [
+        ('none', {}),
+        ('zlib-1', {'compression': 'zlib', 'compression_options': {'level': 1}}),
+        ('zlib-6', {'compression': 'zlib'}),
+    ]
+    if zstandard is not None:
+        samples = [pickle.dumps(make_session(rng, rng.randint(0, 20)), PICKLE_VERSION) for _ in range(1000)]
+        dictionary = train_zstd_dictionary(samples)
+        settings += [
+            ('zstd-3', {'compression': 'zstd'}),
+            ('zstd-3+dict', {'compression': 'zstd', 'compression_options': {'dictionary': dictionary}}),
+        ]
+
+    print('%-8s %-12s %10s %8s %12s' % ('session', 'compression', 'bytes', 'ratio', 'us/roundtrip'))
+    for name, data in sessions.items():
+        raw = len(pickle.dumps(data, PICKLE_VERSION))
+        for label, options in settings:
+            store = RedisSessionStore('redis://localhost:6379/0', compression_threshold=0,
+                                      session_settings={}, **options)
+            size = len(store.encode(data))
+            number = 2000
+            seconds = timeit.timeit(lambda: store.decode(store.encode(data)), number=number)
+            print('%-8s %-12s %10d %7.1fx %12.1f' % (name, label, size, raw / size, seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
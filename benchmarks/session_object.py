@@ -0,0 +1,83 @@
+"""
+Memory and access cost of the `Session` object.
+
+    PYTHONPATH=. python benchmarks/session_object.py
+
+Compares `Session` with `DictSession`, a copy of the previous
+implementation that kept its attributes in an instance `__dict__` and
+proxied `get`, `pop` and `update` through `__getattr__`.
+"""
+import timeit
+import tracemalloc
+
+from apistar_contrib.cookies import NOT_SET
+from apistar_contrib.sessions import LocalMemorySessionStore, Session
+
+INSTANCES = 10000
+NUMBER = 200000
+
+
+class DictSession(object):
+    def __init__(self, store, session_id, data=None, version=None):
+        self.store = store
+        self.settings = store.session_settings
+        self.data = data if data is not None else {}
+        self.is_new = data is None
+        self.needs_cookie = data is None
+        self.is_modified = False
+        self.is_cleared = False
+        self.is_rotated = False
+        self.session_id = session_id
+        self.expires = NOT_SET
+        self.version = version
+        self.changed_keys = set()
+        self.owner = None
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.is_modified = True
+        self.changed_keys.add(key)
+
+    def __getattr__(self, item):
+        if item in ('get', 'pop', 'update'):
+            return getattr(self.data, item)
+        raise AttributeError
+
+
+def instance_size(session_class, store):
+    # Data dicts are shared, so only the session objects themselves count.
+    data = {'user_id': 1}
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [session_class(store, 'id', data) for _ in range(INSTANCES)]
+    size = (tracemalloc.get_traced_memory()[0] - before) / INSTANCES
+    tracemalloc.stop()
+    del sessions
+    return size
+
+
+def main():
+    store = LocalMemorySessionStore(session_settings={})
+    statements = [
+        ('attribute', 'session.is_modified'),
+        ('getitem', "session['user_id']"),
+        ('get', "session.get('user_id')"),
+        ('setitem', "session['user_id'] = 2"),
+        ('update', "session.update(user_id=2)"),
+    ]
+    print('%-12s %10s %10s' % ('', 'dict', 'slots'))
+    print('%-12s %10.0f %10.0f' % ('bytes', instance_size(DictSession, store), instance_size(Session, store)))
+    for name, statement in statements:
+        timings = []
+        for session_class in (DictSession, Session):
+            session = session_class(store, 'id', {'user_id': 1})
+            seconds = min(timeit.repeat(statement, globals={'session': session}, number=NUMBER, repeat=5))
+            timings.append(seconds / NUMBER * 1e9)
+        print('%-12s %8.1fns %8.1fns' % (name, timings[0], timings[1]))
+
+
+if __name__ == '__main__':
+    main()
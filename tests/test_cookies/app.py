@@ -0,0 +1,29 @@
+import os
+from apistar import App, Route, http
+from apistar_contrib.csrf import EnforceCsrfHook
+from apistar_contrib.sessions import Session, SessionComponent, SessionHook, LocalMemorySessionStore
+
+
+def show_form(session: Session):
+    session['seen'] = True
+    return app.render_template('token.html')
+
+
+def set_cookie():
+    return http.HTMLResponse('', headers={'set-cookie': 'other=value; Path=/', 'vary': 'Accept'})
+
+
+routes = [
+    Route('/', 'GET', show_form),
+    Route('/set_cookie', 'GET', set_cookie),
+]
+
+BASE_DIR = os.path.dirname(__file__)
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+
+app = App(
+    routes=routes,
+    components=[SessionComponent(LocalMemorySessionStore)],
+    event_hooks=[SessionHook, EnforceCsrfHook],
+    template_dir=TEMPLATE_DIR,
+)
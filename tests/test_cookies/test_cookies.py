@@ -0,0 +1,100 @@
+import pytest
+from apistar import http, test
+from werkzeug.http import dump_cookie, parse_cookie
+
+from apistar_contrib.cookies import CookieSpec, get_cookie, get_cookies, get_response_cookies
+from apistar_contrib.csrf.settings import CsrfSettings, freeze_settings as freeze_csrf_settings
+from apistar_contrib.sessions.settings import freeze_settings as freeze_session_settings
+from tests.test_cookies.app import app
+
+
+def attributes(header):
+    return sorted(part.strip() for part in header.split(';'))
+
+
+def test_cookie_spec_matches_werkzeug():
+    spec = CookieSpec('session_id', max_age=3600, domain='.example.com', secure=True, httponly=True)
+    expected = dump_cookie('session_id', 'abc123', max_age=3600, domain='.example.com',
+                           secure=True, httponly=True)
+    assert attributes(spec.dump('abc123')) == attributes(expected)
+
+
+def test_cookie_spec_max_age_override():
+    spec = CookieSpec('session_id', max_age=3600)
+    assert spec.dump('abc', max_age=None) == 'session_id=abc; Path=/'
+    assert 'Max-Age=0' in spec.dump('abc', max_age=0)
+
+
+def test_cookie_spec_quotes_unsafe_values():
+    spec = CookieSpec('name')
+    assert spec.dump('a b') == dump_cookie('name', 'a b')
+
+
+def test_freeze_settings():
+    settings = freeze_session_settings({'cookie_name': 'sid', 'cookie_age': 60})
+    assert settings.cookie_name == 'sid'
+    assert settings.cookie.max_age == 60
+    assert freeze_session_settings(settings) is settings
+
+    csrf_settings = freeze_csrf_settings(CsrfSettings({'CSRF_TRUSTED_ORIGINS': ['.example.com']}))
+    assert csrf_settings.CSRF_TRUSTED_ORIGINS == ('.example.com',)
+    assert csrf_settings.CSRF_COOKIE.name == 'csrftoken'
+
+
+def test_get_cookie():
+    header = '_ga=GA1.2.3; xsession_id=wrong; session_id=abc123 ; csrftoken="quoted"; session_id=second'
+    assert get_cookie(header, 'session_id') == 'second'
+    assert get_cookie(header, 'csrftoken') == 'quoted'
+    assert get_cookie(header, '_ga') == 'GA1.2.3'
+    assert get_cookie(header, 'missing') is None
+    assert get_cookie('', 'session_id') is None
+    assert get_cookie(None, 'session_id') is None
+
+
+@pytest.mark.parametrize('header', [
+    'sid=1; sid=2',
+    'a="x;sid=evil"; sid=good',
+    'sid = 3',
+    'a=1;sid=4',
+    ' sid=5 ',
+    'sidx=1; xsid=2; sid=6',
+    'sid; sid=7',
+    'sid=',
+    'other=1',
+])
+def test_get_cookie_matches_werkzeug(header):
+    assert get_cookie(header, 'sid') == parse_cookie(header).get('sid')
+
+
+def test_cookies_are_cached_per_request():
+    headers = http.Headers({'Cookie': 'session_id=abc; csrftoken=xyz'})
+    cookies = get_cookies(headers)
+    assert get_cookies(headers) is cookies
+    assert cookies.get('session_id') == 'abc'
+    assert cookies.get('missing', 'default') == 'default'
+
+
+def test_session_and_csrf_cookies_are_both_set():
+    client = test.TestClient(app)
+    response = client.get('/')
+    assert response.status_code == 200
+    assert response.cookies.get('session_id')
+    assert response.cookies.get('csrftoken')
+    assert response.headers['vary'] == 'Cookie'
+
+
+def test_response_cookies_keep_other_headers():
+    client = test.TestClient(app)
+    response = client.get('/set_cookie')
+    assert response.cookies.get('other') == 'value'
+    assert response.cookies.get('session_id')
+    assert response.headers['vary'] == 'Accept, Cookie'
+
+    response = http.Response(b'', headers=[('set-cookie', 'csrftoken=old'), ('vary', 'Accept')])
+    cookies = get_response_cookies(response)
+    cookies.set('csrftoken', 'csrftoken=new')
+    cookies.add_vary('cookie', 'Accept')
+    cookies.write(response)
+    cookies.write(response)
+    assert response.headers.get_list('set-cookie') == ['csrftoken=new']
+    assert response.headers['vary'] == 'Accept, cookie'
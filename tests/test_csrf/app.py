@@ -1,6 +1,6 @@
 import os
 from apistar import App, Route, http
-from apistar_contrib.csrf import EnforceCsrfHook, rotate_token
+from apistar_contrib.csrf import EnforceCsrfHook, csrf_exempt, csrf_protect, rotate_token
 
 
 def show_form():
@@ -27,10 +27,26 @@ def handle_form(request: http.Request):
     )
 
 
+@csrf_exempt
+def show_exempt_form():
+    return app.render_template(
+        'form.html',
+        show_csrf=True,
+    )
+
+
+@csrf_exempt
+def handle_api(data: http.RequestData):
+    return {'received': data}
+
+
 routes = [
     Route('/', 'GET', show_form),
     Route('/no_csrf', 'GET', show_no_csrf_form),
+    Route('/exempt', 'GET', show_exempt_form),
     Route('/handle', 'POST', handle_form),
+    Route('/api', 'POST', handle_api),
+    csrf_protect(Route('/api/protected', 'POST', handle_api, name='handle_protected_api')),
 ]
 
 BASE_DIR = os.path.dirname(__file__)
@@ -0,0 +1,50 @@
+import os
+from apistar import App, Route
+from apistar_contrib.csrf import EnforceCsrfHook, serve_csrf_token
+from apistar_contrib.csrf.settings import freeze_settings
+
+CSRF_SETTINGS = freeze_settings({'CSRF_DEFER_TOKEN': True})
+
+
+class DeferredCsrfHook(EnforceCsrfHook):
+    def __init__(self):
+        super().__init__(CSRF_SETTINGS)
+
+
+def show_form(app: App):
+    return app.render_template(
+        'form.html',
+        show_csrf=True,
+    )
+
+
+def show_no_csrf_form(app: App):
+    return app.render_template(
+        'form.html',
+        show_csrf=False,
+    )
+
+
+def handle_form(app: App):
+    return app.render_template(
+        'form.html',
+        show_csrf=True,
+        success=True,
+    )
+
+
+routes = [
+    Route('/', 'GET', show_form),
+    Route('/no_csrf', 'GET', show_no_csrf_form),
+    Route('/handle', 'POST', handle_form),
+    Route('/csrf_token', 'GET', serve_csrf_token),
+]
+
+BASE_DIR = os.path.dirname(__file__)
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+
+app = App(
+    routes=routes,
+    event_hooks=[DeferredCsrfHook],
+    template_dir=TEMPLATE_DIR,
+)
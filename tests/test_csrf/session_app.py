@@ -0,0 +1,45 @@
+import os
+from apistar import App, Route, http
+from apistar_contrib.csrf import SessionCsrfHook, rotate_token
+from apistar_contrib.sessions import SessionComponent, SessionHook, LocalMemorySessionStore
+
+
+def show_form(app: App):
+    return app.render_template(
+        'form.html',
+        show_csrf=True,
+    )
+
+
+def show_no_csrf_form(app: App):
+    return app.render_template(
+        'form.html',
+        show_csrf=False,
+    )
+
+
+def handle_form(app: App, request: http.Request):
+    # You should rotate CSRF tokens after successful login/logout
+    rotate_token(request)
+    return app.render_template(
+        'form.html',
+        show_csrf=True,
+        success=True,
+    )
+
+
+routes = [
+    Route('/', 'GET', show_form),
+    Route('/no_csrf', 'GET', show_no_csrf_form),
+    Route('/handle', 'POST', handle_form),
+]
+
+BASE_DIR = os.path.dirname(__file__)
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+
+app = App(
+    routes=routes,
+    components=[SessionComponent(LocalMemorySessionStore)],
+    event_hooks=[SessionHook, SessionCsrfHook],
+    template_dir=TEMPLATE_DIR,
+)
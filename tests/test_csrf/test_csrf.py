@@ -1,8 +1,15 @@
+import re
+
 import pytest
 from apistar import test, exceptions
 
+from apistar_contrib.csrf import get_exempt_routes
+from apistar_contrib.csrf.hook import CSRF_TOKEN_PLACEHOLDER
 from apistar_contrib.csrf.settings import CsrfSettings
+from apistar_contrib.sessions import local
 from tests.test_csrf.app import app
+from tests.test_csrf.deferred_app import app as deferred_app
+from tests.test_csrf.session_app import app as session_app
 
 
 @pytest.fixture
@@ -30,3 +37,75 @@ def test_post_csrf_token(client, settings):
     csrf_token = response.cookies.get(settings.CSRF_COOKIE_NAME)
     response = client.post('/handle', {settings.CSRF_TOKEN_FIELD_NAME: csrf_token})
     assert response.status_code == 200
+
+
+def test_exempt_route(client, settings):
+    response = client.post('/api', json={'a': 1})
+    assert response.status_code == 200
+    assert response.json() == {'received': {'a': 1}}
+    assert settings.CSRF_COOKIE_NAME not in response.cookies
+
+    # A marker on the route wins over the one on its handler.
+    with pytest.raises(exceptions.Forbidden):
+        client.post('/api/protected', json={'a': 1})
+
+
+def test_exempt_route_renders_no_token(client, settings):
+    client.get('/')
+    # Another client's token must not leak into an exempt page.
+    response = test.TestClient(app).get('/exempt')
+    assert response.status_code == 200
+    assert settings.CSRF_TOKEN_FIELD_NAME not in response.text
+    assert settings.CSRF_COOKIE_NAME not in response.cookies
+
+
+def test_exempt_route_table():
+    table = get_exempt_routes(app)
+    assert get_exempt_routes(app) is table
+    assert {route.name: exempt for route, exempt in table.items()} == {
+        'show_exempt_form': True,
+        'handle_api': True,
+        'handle_protected_api': False,
+    }
+
+
+def test_deferred_token(settings):
+    client = test.TestClient(deferred_app)
+    response = client.get('/')
+    assert response.status_code == 200
+    assert 'value="%s"' % CSRF_TOKEN_PLACEHOLDER in response.text
+    assert settings.CSRF_COOKIE_NAME not in response.cookies
+    assert 'vary' not in response.headers
+
+    response = client.get('/csrf_token')
+    assert response.headers['cache-control'] == 'no-store'
+    assert response.headers['vary'] == 'Cookie'
+    assert settings.CSRF_COOKIE_NAME in response.cookies
+    body = response.json()
+    assert body['field_name'] == settings.CSRF_TOKEN_FIELD_NAME
+
+    with pytest.raises(exceptions.Forbidden):
+        client.post('/handle', {settings.CSRF_TOKEN_FIELD_NAME: CSRF_TOKEN_PLACEHOLDER})
+    response = client.post('/handle', {settings.CSRF_TOKEN_FIELD_NAME: body['csrf_token']})
+    assert response.status_code == 200
+
+
+@pytest.fixture
+def session_client():
+    yield test.TestClient(session_app)
+    local.local_memory_sessions.clear()
+
+
+def test_session_csrf_token(session_client, settings):
+    response = session_client.get('/')
+    assert response.status_code == 200
+    assert settings.CSRF_COOKIE_NAME not in response.cookies
+    assert 'session_id' in response.cookies
+    csrf_token = re.search(r'name="csrf_token" value="(\w+)"', response.text).group(1)
+
+    with pytest.raises(exceptions.Forbidden):
+        session_client.post('/handle')
+
+    response = session_client.post('/handle', {settings.CSRF_TOKEN_FIELD_NAME: csrf_token})
+    assert response.status_code == 200
+    assert settings.CSRF_COOKIE_NAME not in response.cookies
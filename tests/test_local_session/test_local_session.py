@@ -1,7 +1,7 @@
 import pytest
 from apistar import test
 
-from apistar_contrib.sessions import local
+from apistar_contrib.sessions import LocalMemorySessionStore, local
 from tests.test_local_session.app import app
 
 
@@ -9,7 +9,8 @@ from tests.test_local_session.app import app
 def client():
     client = test.TestClient(app)
     yield client
-    local.local_memory_sessions = {}
+    local.local_memory_sessions.clear()
+    local.local_memory_last_used.clear()
 
 
 def test_init_session(client):
@@ -31,3 +32,73 @@ def test_clear_session(client):
     response = client.get('/clear')
     assert response.status_code == 200
     assert response.json() == {}
+
+
+def test_rotate_session(client):
+    response = client.get('/?foo=bar')
+    old_session_id = response.cookies['session_id']
+    response = client.get('/rotate')
+    assert response.json() == {'foo': 'bar'}
+    new_session_id = response.cookies['session_id']
+    assert new_session_id != old_session_id
+
+    client.cookies.clear()
+    response = client.get('/', cookies={'session_id': old_session_id})
+    assert response.json() == {}
+    client.cookies.clear()
+    response = client.get('/', cookies={'session_id': new_session_id})
+    assert response.json() == {'foo': 'bar'}
+
+
+def test_session_administration(client):
+    store = LocalMemorySessionStore(session_settings={})
+    for i in range(5):
+        session = store.new()
+        session['index'] = i
+        session.save()
+
+    assert store.count() == 5
+    assert sorted(session['index'] for session in store.iter_sessions(batch_size=2)) == [0, 1, 2, 3, 4]
+
+    assert store.purge(lambda session: session['index'] % 2, batch_size=2) == 2
+    assert store.count() == 3
+
+    assert store.purge(idle_for=3600) == 0
+    for session_id in local.local_memory_last_used:
+        local.local_memory_last_used[session_id] -= 7200
+    assert store.purge(idle_for=3600) == 3
+    assert store.count() == 0
+
+
+def test_session_mapping():
+    store = LocalMemorySessionStore(session_settings={})
+    session = store.load('missing')
+    assert not hasattr(session, '__dict__')
+    # Empty sessions are still truthy, and sessions stay hashable.
+    assert session
+    assert session in {session}
+    assert session != store.load('missing')
+
+    session.update({'a': 1}, b=2)
+    assert session.setdefault('a', 10) == 1
+    assert session.setdefault('c', 3) == 3
+    assert session.pop('missing', None) is None
+    assert session.get('missing', 'default') == 'default'
+    assert dict(session.items()) == {'a': 1, 'b': 2, 'c': 3}
+    assert list(session) == list(session.keys()) == ['a', 'b', 'c']
+    assert len(session) == 3
+    session.save()
+
+    session = store.load(session.session_id)
+    assert not session.is_modified
+    session.get('a')
+    session.pop('missing', None)
+    session.update()
+    session.setdefault('a', 10)
+    assert not session.is_modified
+
+    assert session.pop('a') == 1
+    assert session.is_modified
+    assert session.changed_keys == {'a'}
+    with pytest.raises(KeyError):
+        session.pop('a')
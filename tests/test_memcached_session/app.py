@@ -0,0 +1,35 @@
+from apistar import App, Route, http
+from apistar_contrib.sessions import Session, SessionComponent, SessionHook, MemcachedSessionStore
+from tests.test_memcached_session.server import MemcachedServer
+
+
+def use_session(session: Session, params: http.QueryParams):
+    for key, value in params:
+        session[key] = value
+    return session.data
+
+
+def clear_session(session: Session):
+    session.clear()
+    return session.data
+
+
+def rotate_session(session: Session):
+    session.rotate_id()
+    return session.data
+
+
+routes = [
+    Route('/', 'GET', use_session),
+    Route('/clear', 'GET', clear_session),
+    Route('/rotate', 'GET', rotate_session),
+]
+
+SERVERS = [MemcachedServer().start(), MemcachedServer().start()]
+SERVER_ADDRESSES = [server.address for server in SERVERS]
+
+app = App(
+    routes=routes,
+    components=[SessionComponent(MemcachedSessionStore, SERVER_ADDRESSES, session_settings={'cookie_age': 3600})],
+    event_hooks=[SessionHook]
+)
@@ -0,0 +1,144 @@
+import itertools
+import socketserver
+import threading
+import time
+
+# Expiry times above 30 days are absolute Unix timestamps.
+RELATIVE_EXPIRY_LIMIT = 60 * 60 * 24 * 30
+
+
+class MemcachedServer(object):
+    """
+    In-process stand-in for memcached, speaking the text protocol commands
+    used by the session store. Items are kept in `items` as
+    {key: (value, flags, expires_at, cas)}, and every command line received
+    is appended to `commands`.
+    """
+
+    def __init__(self) -> None:
+        self.items = {}
+        self.commands = []
+        self.lock = threading.Lock()
+        self.cas_counter = itertools.count(1)
+        self.server = socketserver.ThreadingTCPServer(('localhost', 0), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> str:
+        return '%s:%d' % self.server.server_address[:2]
+
+    def start(self) -> 'MemcachedServer':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def flush(self) -> None:
+        with self.lock:
+            self.items.clear()
+            del self.commands[:]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    response = server.execute(line.rstrip(b'\r\n').split(), self.rfile)
+                    if response is None:
+                        return
+                    self.wfile.write(response)
+
+        return Handler
+
+    def execute(self, parts, rfile):
+        if not parts:
+            return b'ERROR\r\n'
+        command = parts[0].decode()
+        self.commands.append(b' '.join(parts).decode())
+        noreply = parts[-1] == b'noreply'
+        with self.lock:
+            if command in ('set', 'add', 'replace', 'cas'):
+                key, flags, expires, size = parts[1], int(parts[2]), int(parts[3]), int(parts[4])
+                value = rfile.read(size + 2)[:-2]
+                response = self._store(command, key, value, flags, expires,
+                                       int(parts[5]) if command == 'cas' else None)
+            elif command in ('get', 'gets'):
+                response = self._get(parts[1:], with_cas=command == 'gets')
+            elif command == 'delete':
+                response = b'DELETED' if self._pop(parts[1]) is not None else b'NOT_FOUND'
+            elif command == 'touch':
+                item = self._lookup(parts[1])
+                if item is None:
+                    response = b'NOT_FOUND'
+                else:
+                    self.items[parts[1]] = (item[0], item[1], self._expires_at(int(parts[2])), item[3])
+                    response = b'TOUCHED'
+            elif command == 'flush_all':
+                self.items.clear()
+                response = b'OK'
+            elif command == 'version':
+                response = b'VERSION 1.6.0-stand-in'
+            elif command == 'quit':
+                return None
+            else:
+                response = b'ERROR'
+        if noreply:
+            return b''
+        return response + b'\r\n'
+
+    def _store(self, command, key, value, flags, expires, cas):
+        item = self._lookup(key)
+        if command == 'add' and item is not None:
+            return b'NOT_STORED'
+        if command == 'replace' and item is None:
+            return b'NOT_STORED'
+        if command == 'cas':
+            if item is None:
+                return b'NOT_FOUND'
+            if item[3] != cas:
+                return b'EXISTS'
+        self.items[key] = (value, flags, self._expires_at(expires), next(self.cas_counter))
+        return b'STORED'
+
+    def _get(self, keys, with_cas):
+        lines = []
+        for key in keys:
+            item = self._lookup(key)
+            if item is None:
+                continue
+            value, flags, _, cas = item
+            header = b'VALUE %s %d %d' % (key, flags, len(value))
+            if with_cas:
+                header += b' %d' % cas
+            lines.append(header + b'\r\n' + value)
+        lines.append(b'END')
+        return b'\r\n'.join(lines)
+
+    def _lookup(self, key):
+        item = self.items.get(key)
+        if item is not None and item[2] is not None and item[2] <= time.time():
+            del self.items[key]
+            return None
+        return item
+
+    def _pop(self, key):
+        item = self._lookup(key)
+        if item is not None:
+            del self.items[key]
+        return item
+
+    def _expires_at(self, expires):
+        if expires == 0:
+            return None
+        if expires < 0:
+            return 0.0
+        if expires > RELATIVE_EXPIRY_LIMIT:
+            return float(expires)
+        return time.time() + expires
@@ -0,0 +1,216 @@
+import threading
+import time
+
+import pytest
+from apistar import test
+
+from apistar_contrib.sessions import MemcachedSessionStore
+from apistar_contrib.sessions.base import SessionConflict
+from tests.test_memcached_session.app import app, SERVERS, SERVER_ADDRESSES
+
+
+@pytest.fixture(autouse=True)
+def servers():
+    yield SERVERS
+    for server in SERVERS:
+        server.flush()
+
+
+@pytest.fixture
+def client():
+    client = test.TestClient(app)
+    yield client
+
+
+@pytest.fixture
+def store():
+    return MemcachedSessionStore(SERVER_ADDRESSES, session_settings={'cookie_age': 3600})
+
+
+def find_item(key):
+    for server in SERVERS:
+        item = server.items.get(key.encode())
+        if item is not None:
+            return item
+    return None
+
+
+def test_init_session(client):
+    response = client.get('/')
+    assert response.status_code == 200
+    assert response.json() == {}
+
+
+def test_write_session(client):
+    response = client.get('/?foo=bar')
+    assert response.json() == {'foo': 'bar'}
+    response = client.get('/?baz=qux')
+    assert response.json() == {'foo': 'bar', 'baz': 'qux'}
+
+
+def test_clear_session(client):
+    response = client.get('/?foo=bar')
+    old_session_id = response.cookies['session_id']
+    response = client.get('/clear')
+    assert response.json() == {}
+    assert response.cookies['session_id'] != old_session_id
+    assert find_item('session:' + old_session_id) is None
+
+
+def test_rotate_session(client):
+    response = client.get('/?foo=bar')
+    old_session_id = response.cookies['session_id']
+    response = client.get('/rotate')
+    assert response.json() == {'foo': 'bar'}
+    new_session_id = response.cookies['session_id']
+    assert new_session_id != old_session_id
+
+    client.cookies.clear()
+    response = client.get('/', cookies={'session_id': old_session_id})
+    assert response.json() == {}
+    client.cookies.clear()
+    response = client.get('/', cookies={'session_id': new_session_id})
+    assert response.json() == {'foo': 'bar'}
+
+
+def test_forged_session_id(client):
+    response = client.get('/', cookies={'session_id': 'bad id\r\nflush_all'})
+    assert response.json() == {}
+    assert not any('flush_all' in command for server in SERVERS for command in server.commands)
+
+
+def test_expiry_follows_cookie_age(store):
+    session = store.new()
+    session['foo'] = 'bar'
+    session.save()
+    _, _, expires_at, _ = find_item(store.get_key(session.session_id))
+    assert 3590 < expires_at - time.time() <= 3600
+
+    # Longer than 30 days is sent as a timestamp.
+    store = MemcachedSessionStore(SERVER_ADDRESSES, session_settings={'cookie_age': 60 * 60 * 24 * 60})
+    assert store.get_expiry() > time.time()
+    store = MemcachedSessionStore(SERVER_ADDRESSES, session_settings={})
+    assert store.get_expiry() == 0
+
+
+def test_sessions_are_spread_across_servers(store):
+    for number in range(20):
+        session = store.new()
+        session['number'] = number
+        session.save()
+    assert all(server.items for server in SERVERS)
+
+    # Each server's part is read with a single command.
+    for server in SERVERS:
+        server.commands.clear()
+    session_ids = [key.decode()[len('session:'):] for server in SERVERS for key in server.items]
+    sessions = store.load_many(session_ids + ['missing'])
+    assert sorted(session['number'] for session in sessions[:-1]) == list(range(20))
+    assert sessions[-1] is None
+    assert [len(server.commands) for server in SERVERS] == [1, 1]
+
+    store.delete_many(session_ids)
+    assert not any(server.items for server in SERVERS)
+
+
+def test_cas_merges_concurrent_writes(store):
+    session = store.new()
+    session.update({'a': 1, 'b': 1})
+    session.save()
+
+    first = store.load(session.session_id)
+    second = store.load(session.session_id)
+    first['c'] = 2
+    second['b'] = 2
+    del second['a']
+    assert first.save()
+    assert second.save()
+    assert store.load(session.session_id).data == {'b': 2, 'c': 2}
+
+    # Changes made elsewhere after the merge are kept too.
+    third = store.load(session.session_id)
+    third['c'] = 3
+    third.save()
+    second['d'] = 4
+    second.save()
+    assert store.load(session.session_id).data == {'b': 2, 'c': 3, 'd': 4}
+
+    # A session deleted in the meantime stays deleted.
+    fourth = store.load(session.session_id)
+    store.delete_many([session.session_id])
+    fourth['e'] = 5
+    assert not fourth.save()
+    assert store.load(session.session_id).is_new
+
+
+def test_cas_merges_in_place_changes(store):
+    session = store.new()
+    session['cart'] = ['a']
+    session.save()
+
+    first = store.load(session.session_id)
+    second = store.load(session.session_id)
+    first['cart'].append('b')
+    first.is_modified = True
+    second['x'] = 1
+    assert second.save()
+    assert first.save()
+    assert store.load(session.session_id).data == {'cart': ['a', 'b'], 'x': 1}
+
+
+def test_cas_gives_up_after_max_attempts(store):
+    session = store.new()
+    session['a'] = 1
+    session.save()
+    session = store.load(session.session_id)
+    session['a'] = 2
+    store.client.cas = lambda *args, **kwargs: False
+    with pytest.raises(SessionConflict):
+        session.save()
+
+
+def test_coalesced_loads(store):
+    store = MemcachedSessionStore(SERVER_ADDRESSES, coalesce_loads=True, coalesce_options={'window': 0.1},
+                                  session_settings={})
+    session_ids = []
+    for number in range(3):
+        session = store.new()
+        session['number'] = number
+        session.save()
+        session_ids.append(session.session_id)
+
+    fetch_many = store.coalescer.fetch_many
+    fetched = []
+    store.coalescer.fetch_many = lambda keys: fetched.append(keys) or fetch_many(keys)
+    sessions = [None] * 6
+
+    def load(index):
+        sessions[index] = store.load(session_ids[index % 3])
+
+    threads = [threading.Thread(target=load, args=(index,)) for index in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [session['number'] for session in sessions] == [0, 1, 2, 0, 1, 2]
+    assert sum(len(keys) for keys in fetched) == 3
+
+
+def test_pooled_connections(store):
+    session = store.new()
+    session['foo'] = 'bar'
+    session.save()
+
+    def load():
+        for _ in range(20):
+            assert store.load(session.session_id)['foo'] == 'bar'
+
+    threads = [threading.Thread(target=load) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Connections are reused, at most one per thread and server.
+    pools = [client.client_pool for client in store.client.clients.values()]
+    assert all(len(pool.free) <= 4 for pool in pools)
@@ -0,0 +1,54 @@
+import pytest
+from apistar import exceptions, test
+
+from apistar_contrib import metrics
+from apistar_contrib.sessions import local
+from tests.test_csrf.app import app as csrf_app
+from tests.test_local_session.app import app as session_app
+
+
+@pytest.fixture
+def sink():
+    sink = metrics.PrometheusMetrics()
+    metrics.set_sink(sink)
+    yield sink
+    metrics.set_sink(metrics.MetricsSink())
+    local.local_memory_sessions.clear()
+
+
+def test_default_sink_is_disabled():
+    assert not metrics.get_sink().enabled
+    with metrics.timed('anything'):
+        pass
+
+
+def test_session_metrics(sink):
+    client = test.TestClient(session_app)
+    client.get('/?foo=bar')
+    client.get('/')
+    client.get('/')
+
+    assert sink.get('session_loads', store='local', result='hit') == 2
+    assert sink.get('session_writes', store='local', result='written') == 1
+    assert sink.get('session_writes', store='local', result='skipped') == 2
+
+    output = sink.render()
+    assert '# TYPE apistar_contrib_session_loads_total counter' in output
+    assert 'apistar_contrib_session_load_seconds_count{store="local"} 2' in output
+    assert 'apistar_contrib_session_hook_seconds_count{store="local"} 3' in output
+
+
+def test_csrf_reject_metrics(sink):
+    client = test.TestClient(csrf_app)
+    with pytest.raises(exceptions.Forbidden):
+        client.post('/handle')
+
+    assert sink.get('csrf_rejects', reason='no_csrf_cookie') == 1
+    assert 'apistar_contrib_csrf_request_seconds_count 1' in sink.render()
+
+
+def test_serve_metrics(sink):
+    sink.increment('example', 3, label='a"b')
+    response = metrics.serve_metrics()
+    assert response.headers['content-type'] == metrics.PrometheusMetrics.content_type
+    assert b'apistar_contrib_example_total{label="a\\"b"} 3' in response.content
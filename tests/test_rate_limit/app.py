@@ -0,0 +1,21 @@
+from apistar import App, Route
+from apistar_contrib.ratelimit import LocalRateLimiter, RateLimit, RateLimitComponent, RateLimitHook
+from apistar_contrib.sessions import LocalMemorySessionStore, SessionComponent, SessionHook
+
+
+def show_limit(rate_limit: RateLimit):
+    return {'remaining': rate_limit.remaining}
+
+
+routes = [
+    Route('/', 'GET', show_limit),
+]
+
+session_component = SessionComponent(LocalMemorySessionStore)
+rate_limit_component = RateLimitComponent(LocalRateLimiter, rate=2, period=60, key='session')
+
+app = App(
+    routes=routes,
+    components=[session_component, rate_limit_component],
+    event_hooks=[RateLimitHook, SessionHook],
+)
@@ -0,0 +1,105 @@
+import pytest
+from apistar import test
+
+from apistar_contrib.compat import redis
+from apistar_contrib.ratelimit import LocalRateLimiter, RedisRateLimiter
+from tests.test_rate_limit.app import app, rate_limit_component, session_component
+from tests.test_redis_session.app import REDIS_URL
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=['local', 'redis'])
+def limiter_class(request):
+    if request.param == 'local':
+        yield LocalRateLimiter
+    else:
+        client = redis.StrictRedis.from_url(REDIS_URL)
+        client.ping()
+        yield lambda *args, **kwargs: RedisRateLimiter(*args, client=client, **kwargs)
+        for key in client.scan_iter(match='rate_limit:*'):
+            client.delete(key)
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_token_bucket(limiter_class, clock):
+    limiter = limiter_class(rate=2, period=1, burst=3)
+    limiter.clock = clock
+    assert [limiter.hit('a').allowed for _ in range(4)] == [True, True, True, False]
+    assert limiter.hit('b').remaining == 2
+
+    rate_limit = limiter.hit('a')
+    assert not rate_limit.allowed
+    assert rate_limit.retry_after == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert limiter.hit('a').allowed
+    assert not limiter.hit('a').allowed
+    clock.now += 10
+    assert limiter.hit('a').remaining == 2
+
+
+def test_leases(limiter_class, clock):
+    limiter = limiter_class(rate=10, period=1, lease_size=4, lease_ttl=1)
+    limiter.clock = clock
+    taken = []
+    limiter.take = lambda *args, take=limiter.take: taken.append(args) or take(*args)
+
+    assert [limiter.hit('a').remaining for _ in range(6)] == [9, 8, 7, 6, 5, 4]
+    # The first request leased the next four, the sixth had to ask again.
+    assert len(taken) == 2
+
+    # Leases expire, and never hand out more than the bucket held.
+    clock.now += 1.5
+    results = [limiter.hit('a').allowed for _ in range(20)]
+    assert results.count(True) == 10
+
+
+def test_redis_buckets_use_server_time():
+    client = redis.StrictRedis.from_url(REDIS_URL)
+    client.ping()
+    limiter = RedisRateLimiter(client=client, rate=2, period=1, burst=3)
+    assert limiter.hit('server-time').remaining == 2
+    seconds, microseconds = client.time()
+    assert float(client.hget('rate_limit:server-time', 'ts')) == pytest.approx(seconds + microseconds / 1e6, abs=1)
+    client.delete('rate_limit:server-time')
+
+
+def test_hook():
+    client = test.TestClient(app)
+    response = client.get('/')
+    assert response.json() == {'remaining': 1}
+    assert response.headers['x-ratelimit-limit'] == '2'
+    assert response.headers['x-ratelimit-remaining'] == '1'
+    client.cookies.clear()
+    client.get('/')
+
+    client.cookies.clear()
+    response = client.get('/')
+    assert response.status_code == 429
+    assert response.headers['retry-after'] == '30'
+    assert response.headers['x-ratelimit-remaining'] == '0'
+
+    # Forged session IDs share the client IP's bucket.
+    for session_id in ('abc', 'def'):
+        client.cookies.clear()
+        response = client.get('/', cookies={'session_id': session_id})
+        assert response.status_code == 429
+
+    # Each stored session has its own bucket.
+    session = session_component.store.new()
+    session.save()
+    client.cookies.clear()
+    response = client.get('/', cookies={'session_id': session.session_id})
+    assert response.json() == {'remaining': 1}
+    rate_limit_component.limiter.buckets.clear()
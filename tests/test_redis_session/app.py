@@ -13,9 +13,15 @@ def clear_session(session: Session):
     return session.data
 
 
+def rotate_session(session: Session):
+    session.rotate_id()
+    return session.data
+
+
 routes = [
     Route('/', 'GET', use_session),
     Route('/clear', 'GET', clear_session),
+    Route('/rotate', 'GET', rotate_session),
 ]
 
 REDIS_URL = 'redis://localhost:6379/0'
@@ -0,0 +1,52 @@
+import socket
+import threading
+import time
+
+
+class LatencyProxy(object):
+    """
+    TCP proxy in front of the test Redis server that delays every command
+    by `delay` seconds, to simulate a stalled server.
+    """
+
+    def __init__(self, upstream=('localhost', 6379)):
+        self.upstream = upstream
+        self.delay = 0.0
+        self.server = socket.socket()
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(16)
+        self.url = 'redis://127.0.0.1:%d/0' % self.server.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(self.upstream)
+            threading.Thread(target=self._pump, args=(client, upstream, True), daemon=True).start()
+            threading.Thread(target=self._pump, args=(upstream, client, False), daemon=True).start()
+
+    def _pump(self, source, target, delayed):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                if delayed and self.delay:
+                    time.sleep(self.delay)
+                target.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (source, target):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                sock.close()
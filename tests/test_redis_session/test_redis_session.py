@@ -1,8 +1,19 @@
+import os
+import threading
+import time
+
 import pytest
 from apistar import test
 
-from apistar_contrib.compat import redis
+from apistar_contrib.compat import PICKLE_VERSION, pickle, redis
+from apistar_contrib.sessions import RedisSessionStore, redis as redis_sessions
+from apistar_contrib.sessions.base import SessionConflict
+from apistar_contrib.sessions.circuit import CircuitBreaker, CircuitOpen
+from apistar_contrib.sessions.coalesce import LoadCoalescer
+from apistar_contrib.sessions.compression import ZLIB_FLAG, ZSTD_FLAG, train_zstd_dictionary
+from apistar_contrib.sessions.replicas import ReplicaSelector
 from tests.test_redis_session.app import app, REDIS_URL
+from tests.test_redis_session.latency import LatencyProxy
 
 
 @pytest.fixture(scope='module')
@@ -38,3 +49,549 @@ def test_clear_session(client):
     response = client.get('/clear')
     assert response.status_code == 200
     assert response.json() == {}
+
+
+def test_rotate_session(client):
+    response = client.get('/?foo=bar')
+    old_session_id = response.cookies['session_id']
+    response = client.get('/rotate')
+    assert response.json() == {'foo': 'bar'}
+    new_session_id = response.cookies['session_id']
+    assert new_session_id != old_session_id
+
+    client.cookies.clear()
+    response = client.get('/', cookies={'session_id': old_session_id})
+    assert response.json() == {}
+    client.cookies.clear()
+    response = client.get('/', cookies={'session_id': new_session_id})
+    assert response.json() == {'foo': 'bar'}
+
+
+def test_versioned_sessions_merge_concurrent_writes(redis_client):
+    store = RedisSessionStore(REDIS_URL, versioned=True, session_settings={})
+    session = store.new()
+    session['count'] = 0
+    session['stale'] = True
+    session.save()
+    assert session.version == 1
+
+    first = store.load(session.session_id)
+    second = store.load(session.session_id)
+    first['cart'] = ['book']
+    del first['stale']
+    second['user'] = 'ryan'
+    second['count'] = 1
+    first.save()
+    second.save()
+
+    assert second.version == 3
+    assert store.load(session.session_id).data == {'count': 1, 'cart': ['book'], 'user': 'ryan'}
+
+
+def test_versioned_sessions_merge_in_place_changes(redis_client):
+    store = RedisSessionStore(REDIS_URL, versioned=True, session_settings={})
+    session = store.new()
+    session['cart'] = ['a']
+    session.save()
+
+    first = store.load(session.session_id)
+    second = store.load(session.session_id)
+    first['cart'].append('b')
+    first.is_modified = True
+    second['x'] = 1
+    assert second.save()
+    assert first.save()
+    assert store.load(session.session_id).data == {'cart': ['a', 'b'], 'x': 1}
+
+
+def test_versioned_sessions_stay_deleted(redis_client):
+    store = RedisSessionStore(REDIS_URL, versioned=True, session_settings={})
+    session = store.new()
+    session['user'] = 'ryan'
+    session.save()
+
+    stale = store.load(session.session_id)
+    store.delete_many([session.session_id])
+    stale['cart'] = ['book']
+    assert not stale.save()
+    assert store.load(session.session_id).is_new
+
+
+def test_versioned_sessions_give_up_after_max_attempts(redis_client):
+    store = RedisSessionStore(REDIS_URL, versioned=True, max_merge_attempts=0, session_settings={})
+    session = store.new()
+    session['foo'] = 'bar'
+    with pytest.raises(SessionConflict):
+        session.save()
+
+
+def test_compressed_sessions(redis_client):
+    store = RedisSessionStore(REDIS_URL, compression='zlib', compression_threshold=100, session_settings={})
+    small = {'user': 'ryan'}
+    large = {'cart': ['item-%d' % i for i in range(100)]}
+    assert store.encode(small)[:1] == pickle.dumps(small, PICKLE_VERSION)[:1]
+    assert store.encode(large)[:1] == ZLIB_FLAG
+    assert len(store.encode(large)) < len(pickle.dumps(large, PICKLE_VERSION))
+
+    session = store.new()
+    session['cart'] = large['cart']
+    session.save()
+
+    # Compressed and uncompressed payloads can be read by any configuration.
+    plain_store = RedisSessionStore(REDIS_URL, session_settings={})
+    assert plain_store.load(session.session_id).data == large
+    assert store.decode(plain_store.encode(small)) == small
+
+
+@pytest.mark.parametrize('options', [{}, {'compression': 'zlib', 'compression_threshold': 10}, {'versioned': True}])
+def test_detect_changes(redis_client, monkeypatch, options):
+    store = RedisSessionStore(REDIS_URL, detect_changes=True, session_settings={}, **options)
+    session = store.new()
+    session['cart'] = ['a']
+    assert session.save()
+    session_id = session.session_id
+
+    # Unchanged sessions are told apart by a single digest of the payload.
+    digested = []
+    monkeypatch.setattr(redis_sessions, 'get_digests',
+                        lambda data, get_digests=redis_sessions.get_digests: digested.append(data) or get_digests(data))
+    session = store.load(session_id)
+    assert not session.save()
+    assert not digested
+    # Equal values don't cause a write.
+    session['cart'] = ['a']
+    assert not session.save()
+
+    session['cart'].append('b')
+    assert session.save()
+    assert not session.save()
+    assert store.load(session_id).data == {'cart': ['a', 'b']}
+
+
+def test_detect_changes_merges_only_changed_keys(redis_client):
+    store = RedisSessionStore(REDIS_URL, detect_changes=True, versioned=True, session_settings={})
+    session = store.new()
+    session.update({'cart': ['a'], 'seen': [1], 'user': 'ryan'})
+    session.save()
+
+    first = store.load(session.session_id)
+    second = store.load(session.session_id)
+    first['cart'].append('b')
+    second['seen'].append(2)
+    second['user'] = 'ryan'
+    assert first.save()
+    assert second.save()
+    assert second.changed_keys == {'seen'}
+    assert store.load(session.session_id).data == {'cart': ['a', 'b'], 'seen': [1, 2], 'user': 'ryan'}
+
+
+def test_zstd_compressed_sessions_with_dictionary(redis_client):
+    pytest.importorskip('zstandard')
+    samples = [pickle.dumps({'user': i, 'cart': ['item-%d' % j for j in range(i % 20)]}, PICKLE_VERSION)
+               for i in range(500)]
+    dictionary = train_zstd_dictionary(samples, size=4096)
+    store = RedisSessionStore(REDIS_URL, compression='zstd', compression_threshold=0,
+                              compression_options={'dictionary': dictionary}, session_settings={})
+    data = {'user': 7, 'cart': ['item-%d' % j for j in range(7)]}
+    assert store.encode(data)[:1] == ZSTD_FLAG
+    assert store.decode(store.encode(data)) == data
+
+    # Only stores that have the dictionary can read the payload.
+    other = RedisSessionStore(REDIS_URL, compression='zstd', session_settings={})
+    with pytest.raises(ValueError):
+        other.decode(store.encode(data))
+    assert store.decode(other.encode(data)) == data
+    new_dictionary = train_zstd_dictionary(samples[::-1], size=2048)
+    rotated = RedisSessionStore(REDIS_URL, compression='zstd', compression_threshold=0,
+                                compression_options={'dictionary': new_dictionary,
+                                                     'previous_dictionaries': [dictionary]},
+                                session_settings={})
+    assert rotated.decode(store.encode(data)) == data
+
+
+def test_owner_index_and_invalidation(redis_client):
+    store = RedisSessionStore(REDIS_URL, owner_key='user_id', session_settings={'cookie_age': 3600})
+    sessions = []
+    for i in range(3):
+        session = store.new()
+        session['user_id'] = 42
+        session.save()
+        sessions.append(session)
+    other = store.new()
+    other['user_id'] = 7
+    other.save()
+
+    owner_key = store.get_owner_key(42)
+    # The index lasts as long as the sessions it lists.
+    assert redis_client.ttl(owner_key) == -1
+    assert redis_client.scard(owner_key) == 3
+
+    # Logging out removes the session from its owner's index.
+    session = store.load(sessions[0].session_id)
+    session.clear()
+    session.save()
+    assert redis_client.scard(owner_key) == 2
+
+    # Saves that keep the owner and ID leave the index alone.
+    store.delete_many([sessions[1].session_id])
+    session = store.load(sessions[2].session_id)
+    session['seen'] = True
+    session.save()
+    assert redis_client.scard(owner_key) == 2
+
+    # Sessions deleted elsewhere are pruned on the owner's next login.
+    session = store.new()
+    session['user_id'] = 42
+    session.save()
+    sessions.append(session)
+    assert redis_client.smembers(owner_key) == {sessions[2].session_id.encode(), session.session_id.encode()}
+
+    assert store.invalidate_owner(42) == 2
+    assert all(store.load(session.session_id).is_new for session in sessions)
+    assert not redis_client.exists(owner_key)
+    assert not store.load(other.session_id).is_new
+
+
+def test_iter_session_ids_drops_repeated_keys(redis_client):
+    redis_client.flushdb()
+    store = RedisSessionStore(REDIS_URL, session_settings={})
+    session = store.new()
+    session.save()
+    key = store.get_key(session.session_id).encode()
+    store.client.scan = lambda cursor, **kwargs: (0, [key, key])
+    assert list(store.iter_session_ids()) == [session.session_id]
+    assert store.count() == 1
+
+
+@pytest.mark.parametrize('options', [{}, {'versioned': True}])
+def test_session_administration(redis_client, options):
+    redis_client.flushdb()
+    store = RedisSessionStore(REDIS_URL, session_settings={}, **options)
+    for i in range(5):
+        session = store.new()
+        session['index'] = i
+        session.save()
+    redis_client.set('unrelated', 1)
+
+    assert store.count(batch_size=2) == 5
+    assert sorted(session['index'] for session in store.iter_sessions(batch_size=2)) == [0, 1, 2, 3, 4]
+    assert store.purge(lambda session: session['index'] % 2, batch_size=2) == 2
+    assert store.count() == 3
+    assert redis_client.exists('unrelated')
+
+
+@pytest.mark.parametrize('options', [{}, {'versioned': True}])
+def test_load_many_does_not_touch_keys(redis_client, options):
+    store = RedisSessionStore(REDIS_URL, session_settings={}, **options)
+    session = store.new()
+    session['foo'] = 'bar'
+    session.save()
+
+    pipeline = store.client.pipeline
+    commands = []
+
+    def recording_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def recording_execute(*args, **kwargs):
+            commands.extend(command[0] for command in pipe.command_stack)
+            return execute(*args, **kwargs)
+
+        pipe.execute = recording_execute
+        return pipe
+
+    store.client.pipeline = recording_pipeline
+    assert store.load_many([session.session_id, 'missing'])[0]['foo'] == 'bar'
+    assert commands[0] == ('CLIENT', 'NO-TOUCH', 'ON')
+    assert commands[-1] == ('CLIENT', 'NO-TOUCH', 'OFF')
+
+
+@pytest.mark.parametrize('options', [{}, {'versioned': True}])
+def test_rotate_id_keeps_data_and_ttl(redis_client, options):
+    store = RedisSessionStore(REDIS_URL, session_settings={}, **options)
+    session = store.new()
+    session['foo'] = 'bar'
+    session.save()
+    old_key = store.get_key(session.session_id)
+    redis_client.expire(old_key, 3600)
+
+    session = store.load(session.session_id)
+    session.rotate_id()
+    session.save()
+    new_key = store.get_key(session.session_id)
+    assert not redis_client.exists(old_key)
+    assert 0 < redis_client.ttl(new_key) <= 3600
+    assert store.load(session.session_id)['foo'] == 'bar'
+
+    session.rotate_id()
+    session['foo'] = 'baz'
+    session.save()
+    assert not redis_client.exists(new_key)
+    assert store.load(session.session_id)['foo'] == 'baz'
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker('test', (ValueError,), failure_threshold=2, slow_call_threshold=0.05,
+                             reset_timeout=0.1)
+
+    def fail():
+        raise ValueError
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            breaker.call(fail)
+    with pytest.raises(CircuitOpen):
+        breaker.call(lambda: None)
+
+    # A successful trial call closes the circuit.
+    time.sleep(0.1)
+    assert breaker.call(lambda: 1) == 1
+    assert breaker.state == 'closed'
+
+    # Slow calls return their result but count as failures.
+    assert breaker.call(time.sleep, 0.06) is None
+    assert breaker.call(time.sleep, 0.06) is None
+    assert breaker.state == 'open'
+
+
+@pytest.fixture
+def latency_proxy(redis_client):
+    proxy = LatencyProxy()
+    yield proxy
+    proxy.close()
+
+
+def test_degraded_local_fallback(latency_proxy):
+    store = RedisSessionStore(latency_proxy.url, timeout=0.05, circuit_breaker=True, fallback='local',
+                              circuit_breaker_options={'failure_threshold': 2, 'reset_timeout': 0.2},
+                              session_settings={})
+    session = store.new()
+    session.update(user=1, cart=[])
+    session.save()
+    session_id = session.session_id
+
+    latency_proxy.delay = 0.2
+    session = store.load(session_id)
+    assert session.data == {}
+    assert not session.is_new and not session.needs_cookie
+    session['cart'] = ['a']
+    assert session.save()
+    assert store.breaker.state == 'open'
+    # The client's ID can't be checked, so the session moves to a new one.
+    assert session.needs_cookie
+    degraded_id = session.session_id
+    assert degraded_id != session_id
+
+    # Served locally without waiting on Redis.
+    start = time.monotonic()
+    assert store.load(degraded_id).data == {'cart': ['a']}
+    assert time.monotonic() - start < 0.05
+
+    # Forged IDs are never written.
+    forged = store.load('forged')
+    forged['user'] = 2
+    forged.save()
+    assert forged.session_id != 'forged'
+
+    # Once Redis is back, the changes are merged into what it had.
+    latency_proxy.delay = 0
+    time.sleep(0.2)
+    assert store.load(degraded_id).data == {'user': 1, 'cart': ['a']}
+    # The others are written back in the background.
+    store.reconcile_thread.join()
+    assert not store.degraded_sessions
+    plain_store = RedisSessionStore(REDIS_URL, session_settings={})
+    assert plain_store.load(degraded_id).data == {'user': 1, 'cart': ['a']}
+    assert plain_store.load(session_id).is_new
+    assert plain_store.load(forged.session_id).data == {'user': 2}
+    assert plain_store.load('forged').is_new
+
+
+def test_degraded_anonymous_fallback(latency_proxy):
+    store = RedisSessionStore(latency_proxy.url, timeout=0.05, fallback='anonymous', session_settings={})
+    session = store.new()
+    session['user'] = 1
+    session.save()
+
+    latency_proxy.delay = 0.2
+    session = store.load(session.session_id)
+    assert session.data == {}
+    session['user'] = 2
+    assert not session.save()
+
+    latency_proxy.delay = 0
+    assert store.load(session.session_id).data == {'user': 1}
+
+
+def test_replica_reads(redis_client, latency_proxy):
+    # Separate databases stand in for replicas that haven't caught up.
+    replica_urls = [REDIS_URL[:-1] + '1', REDIS_URL[:-1] + '2']
+    replicas = [redis.StrictRedis.from_url(url) for url in replica_urls]
+    store = RedisSessionStore(REDIS_URL, versioned=True, replica_urls=replica_urls, read_your_writes_window=0.1,
+                              session_settings={})
+    session = store.new()
+    session['user'] = 1
+    session.save()
+
+    # Reads go to the primary right after a write.
+    assert store.load(session.session_id).data == {'user': 1}
+    time.sleep(0.1)
+    # Sessions the replicas don't have yet are read from the primary.
+    assert store.load(session.session_id).data == {'user': 1}
+    assert store.load('missing').is_new
+
+    for number, replica in enumerate(replicas):
+        replica.hset(store.get_key(session.session_id), 'data', store.encode({'replica': number}))
+    try:
+        loaded = [store.load(session.session_id).data['replica'] for _ in range(4)]
+        assert sorted(loaded) == [0, 0, 1, 1]
+
+        # The slower replica is avoided.
+        latency_proxy.delay = 0.02
+        store = RedisSessionStore(REDIS_URL, versioned=True,
+                                  replica_urls=[latency_proxy.url[:-1] + '1', replica_urls[1]],
+                                  replica_strategy='least_latency', session_settings={})
+        loaded = [store.load(session.session_id).data['replica'] for _ in range(10)]
+        assert loaded.count(1) >= 8
+    finally:
+        for replica in replicas:
+            replica.flushdb()
+
+
+def test_replica_errors_fall_back_to_primary(redis_client):
+    store = RedisSessionStore(REDIS_URL, versioned=True, replica_urls=['redis://127.0.0.1:1/0'],
+                              read_your_writes_window=0, session_settings={})
+    session = store.new()
+    session['user'] = 1
+    session.save()
+    assert store.load(session.session_id).data == {'user': 1}
+    assert store.replicas.failed_until[0] is not None
+
+
+def test_replicas_require_versioned_sessions():
+    with pytest.raises(AssertionError):
+        RedisSessionStore(REDIS_URL, replica_urls=[REDIS_URL], session_settings={})
+
+
+def test_replica_selector_skips_failed_replicas():
+    for strategy in ('round_robin', 'least_latency'):
+        selector = ReplicaSelector(['a', 'b'], strategy, error_timeout=0.05)
+        selector.record(1, 0.01)
+        selector.record_error(0)
+        assert [selector.choose()[1] for _ in range(4)] == ['b'] * 4
+        selector.record_error(1)
+        assert selector.choose() == (None, None)
+
+        # After the timeout a failed replica gets a trial read, and competes
+        # on latency again if it succeeds.
+        time.sleep(0.05)
+        assert selector.choose()[1] == 'a'
+        selector.record(0, 0.001)
+        choices = {selector.choose()[1] for _ in range(4)}
+        assert 'a' in choices
+
+
+def test_load_coalescer():
+    release = threading.Event()
+    fetched = []
+
+    def fetch_many(keys):
+        fetched.append(keys)
+        if len(fetched) == 1:
+            release.wait(1)
+        return [key.upper() for key in keys]
+
+    coalescer = LoadCoalescer(fetch_many)
+    results = {}
+
+    def get(name, key):
+        results[name] = coalescer.get(key)
+
+    # The first load goes out alone, the rest queue behind it in one batch.
+    first = threading.Thread(target=get, args=('first', 'a'))
+    first.start()
+    while not fetched:
+        time.sleep(0.001)
+    threads = [threading.Thread(target=get, args=(index, key)) for index, key in enumerate('bcbd')]
+    for thread in threads:
+        thread.start()
+    while coalescer.pending is None or len(coalescer.pending.keys) < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in [first] + threads:
+        thread.join()
+
+    assert fetched == [['a'], ['b', 'c', 'd']]
+    assert results == {'first': 'A', 0: 'B', 1: 'C', 2: 'B', 3: 'D'}
+
+
+def test_coalesced_loads(redis_client):
+    store = RedisSessionStore(REDIS_URL, coalesce_loads=True, coalesce_options={'window': 0.1},
+                              session_settings={})
+    session_ids = []
+    for number in range(3):
+        session = store.new()
+        session['number'] = number
+        session.save()
+        session_ids.append(session.session_id)
+    store.recent_writes = None
+
+    fetch_many = store.coalescer.fetch_many
+    fetched = []
+    store.coalescer.fetch_many = lambda keys: fetched.append(keys) or fetch_many(keys)
+    sessions = [None] * 6
+
+    def load(index):
+        sessions[index] = store.load(session_ids[index % 3])
+
+    threads = [threading.Thread(target=load, args=(index,)) for index in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [session['number'] for session in sessions] == [0, 1, 2, 0, 1, 2]
+    # Every request gets its own session object.
+    assert sessions[0] is not sessions[3]
+    assert sum(len(keys) for keys in fetched) == 3
+
+
+@pytest.mark.skipif(not hasattr(os, 'register_at_fork'), reason='requires os.register_at_fork')
+def test_after_fork(redis_client):
+    store = RedisSessionStore(REDIS_URL, write_behind=True, write_behind_options={'window': 60},
+                              session_settings={})
+    session = store.new()
+    session['worker'] = 'parent'
+    session.save()
+    store.write_queue.flush()
+    parent_connections = list(store.client.connection_pool._available_connections)
+    assert parent_connections
+
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            pool = store.client.connection_pool
+            # The pool was reset and is pre-warmed in the background with a
+            # connection of its own.
+            deadline = time.monotonic() + 1
+            while not pool._available_connections and time.monotonic() < deadline:
+                time.sleep(0.001)
+            assert len(pool._available_connections) == 1
+            assert pool._available_connections[0] not in parent_connections
+            assert store.write_queue.thread.is_alive()
+            loaded = store.load(session.session_id)
+            loaded['worker'] = 'child'
+            loaded.save()
+            store.write_queue.close()
+            status = 0
+        finally:
+            os._exit(status)
+
+    _, status = os.waitpid(pid, 0)
+    assert status == 0
+    # The parent's connections still work.
+    assert store.client.connection_pool._available_connections == parent_connections
+    assert store.load(session.session_id)['worker'] == 'child'
+    store.write_queue.close()
@@ -0,0 +1,43 @@
+from apistar import App, Route, http
+from apistar_contrib.sessions import Session, SessionComponent, SessionHook, LocalMemorySessionStore
+
+calls = {}
+
+
+def count(name):
+    calls[name] = calls.get(name, 0) + 1
+    return calls[name]
+
+
+def show_item(item_id: int):
+    return {'item_id': item_id, 'calls': count('show_item')}
+
+
+def show_greeting(accept_language: http.Header):
+    return http.JSONResponse({'language': accept_language, 'calls': count('show_greeting')},
+                             headers={'vary': 'Accept-Language'})
+
+
+def show_private():
+    return http.JSONResponse({'calls': count('show_private')}, headers={'cache-control': 'private'})
+
+
+def show_session(session: Session):
+    session['seen'] = True
+    return {'calls': count('show_session')}
+
+
+routes = [
+    Route('/items/{item_id}', 'GET', show_item),
+    Route('/greeting', 'GET', show_greeting),
+    Route('/private', 'GET', show_private),
+]
+
+app = App(routes=routes)
+
+# Every response of an app using sessions depends on them.
+session_app = App(
+    routes=[Route('/session', 'GET', show_session)],
+    components=[SessionComponent(LocalMemorySessionStore)],
+    event_hooks=[SessionHook],
+)
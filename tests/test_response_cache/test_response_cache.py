@@ -0,0 +1,89 @@
+import pytest
+from apistar import test
+
+from apistar_contrib.cache import LocalResponseCacheBackend, RedisResponseCacheBackend, ResponseCache
+from apistar_contrib.compat import redis
+from tests.test_redis_session.app import REDIS_URL
+from apistar_contrib.sessions import local
+from tests.test_response_cache.app import app, calls, session_app
+
+
+@pytest.fixture(params=['local', 'redis'])
+def backend(request):
+    if request.param == 'local':
+        backend = LocalResponseCacheBackend()
+    else:
+        client = redis.StrictRedis.from_url(REDIS_URL)
+        client.ping()
+        backend = RedisResponseCacheBackend(client=client)
+    yield backend
+    backend.clear()
+    calls.clear()
+
+
+@pytest.fixture
+def client(backend):
+    return test.TestClient(ResponseCache(app, backend))
+
+
+def test_cached_response(client):
+    response = client.get('/items/1?a=b')
+    assert response.json() == {'item_id': 1, 'calls': 1}
+    etag = response.headers['etag']
+
+    response = client.get('/items/1?a=b')
+    assert response.json() == {'item_id': 1, 'calls': 1}
+    assert response.headers['etag'] == etag
+
+    # The query string is part of the key.
+    assert client.get('/items/1').json() == {'item_id': 1, 'calls': 2}
+    assert client.get('/items/2?a=b').json() == {'item_id': 2, 'calls': 3}
+
+
+def test_not_modified(client):
+    etag = client.get('/items/1').headers['etag']
+    response = client.get('/items/1', headers={'If-None-Match': 'W/"other", ' + etag})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['etag'] == etag
+    assert calls['show_item'] == 1
+
+    response = client.get('/items/1', headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200
+
+
+def test_vary(client):
+    assert client.get('/greeting', headers={'Accept-Language': 'en'}).json() == {'language': 'en', 'calls': 1}
+    assert client.get('/greeting', headers={'Accept-Language': 'fr'}).json() == {'language': 'fr', 'calls': 2}
+    assert client.get('/greeting', headers={'Accept-Language': 'en'}).json() == {'language': 'en', 'calls': 1}
+
+
+def test_private_responses_are_not_cached(client):
+    assert client.get('/private').json() == {'calls': 1}
+    assert client.get('/private').json() == {'calls': 2}
+    assert 'etag' not in client.get('/private').headers
+
+
+def test_session_responses_are_not_cached(backend):
+    client = test.TestClient(ResponseCache(session_app, backend))
+    response = client.get('/session')
+    assert response.json() == {'calls': 1}
+    assert response.headers['vary'] == 'Cookie'
+    # Loaded sessions mark the response even when no cookie is set.
+    response = client.get('/session')
+    assert response.json() == {'calls': 2}
+    assert 'set-cookie' not in response.headers
+    assert response.headers['vary'] == 'Cookie'
+    local.local_memory_sessions.clear()
+
+
+def test_lru_eviction():
+    backend = LocalResponseCacheBackend(max_entries=2)
+    backend.set('a', 1, 60)
+    backend.set('b', 2, 60)
+    assert backend.get('a') == 1
+    backend.set('c', 3, 60)
+    assert backend.get('b') is None
+    assert backend.get('a') == 1
+    backend.set('d', 4, 0)
+    assert backend.get('d') is None
@@ -0,0 +1,65 @@
+import pytest
+
+from apistar_contrib.compat import redis
+from apistar_contrib.sessions import RedisSessionStore
+from apistar_contrib.sessions.writebehind import NOT_SET, WriteBehindQueue
+from tests.test_redis_session.app import REDIS_URL
+
+
+class RecordingFlush:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, batch):
+        self.batches.append(batch)
+
+
+def test_writes_are_coalesced_and_batched():
+    flush = RecordingFlush()
+    queue = WriteBehindQueue(flush, window=60, batch_size=2)
+    queue.put('a', 1)
+    queue.put('b', 1)
+    queue.put('a', 2)
+    queue.put('c', 1)
+    assert queue.get('a') == 2
+    assert queue.get('missing') is NOT_SET
+
+    queue.close()
+    assert flush.batches == [[('a', 2), ('b', 1)], [('c', 1)]]
+    assert not queue.put('d', 1)
+
+
+def test_backpressure_when_full():
+    flush = RecordingFlush()
+    queue = WriteBehindQueue(flush, max_size=1, window=60, put_timeout=0.01)
+    # Hold the flush lock so nothing drains while the queue is full.
+    with queue.flush_lock:
+        assert queue.put('a', 1)
+        assert not queue.put('b', 1)
+        assert queue.put('a', 2)
+    queue.close()
+    assert flush.batches == [[('a', 2)]]
+
+
+@pytest.fixture
+def redis_client():
+    client = redis.StrictRedis.from_url(REDIS_URL)
+    client.ping()
+    yield client
+    client.flushdb()
+
+
+def test_redis_store_write_behind(redis_client):
+    store = RedisSessionStore(REDIS_URL, write_behind=True, write_behind_options={'window': 60},
+                              session_settings={})
+    session = store.new()
+    session['foo'] = 'bar'
+    session.save()
+
+    # Reads see the pending write before it is flushed.
+    assert store.load(session.session_id)['foo'] == 'bar'
+    assert not redis_client.exists(store.get_key(session.session_id))
+
+    store.close()
+    assert redis_client.exists(store.get_key(session.session_id))
+    assert store.load(session.session_id)['foo'] == 'bar'